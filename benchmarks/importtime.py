@@ -0,0 +1,66 @@
+"""
+Import times of the dul commands
+
+Each command module is imported in a fresh interpreter with `python -X importtime`, and
+its cumulative import time is reported along with the top-level packages it imports.
+The lazy imports and the import time budgets are checked by `tests/test_importtime.py`.
+
+How to use (from the root of this repo):
+```
+python benchmarks/importtime.py
+python benchmarks/importtime.py dul.scripts.common.modules --repeat 10
+```
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules of the console entry points
+commands = [
+    "dul.scripts.atlantis.populate_config",
+    "dul.scripts.terraform.docs",
+    "dul.scripts.terraform.tfsec",
+]
+
+
+def importtime(module: str) -> tuple[float, set[str]]:
+    """Function to import a module in a fresh interpreter.
+
+    Returns:
+        The cumulative import time of the module in milliseconds, and the top-level
+        packages imported.
+    """
+    env = dict(os.environ, PYTHONPATH=package_root)
+    sub = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    cumulative = 0.0
+    packages = set()
+    for line in sub.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <indented module name>
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        name = name.strip()
+        packages.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(total) / 1000
+    return cumulative, packages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="importtime")
+    parser.add_argument("modules", nargs="*", help="Modules to import. The commands if not set")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per module, the fastest is kept")
+    args = parser.parse_args()
+
+    for module in args.modules or commands:
+        runs = [importtime(module) for _ in range(max(1, args.repeat))]
+        best = min(ms for ms, _ in runs)
+        packages = set.union(*(packages for _, packages in runs))
+        print(f"{module:<40} {best:>7.1f} ms {len(packages):>5} top-level packages")
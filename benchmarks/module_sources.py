@@ -0,0 +1,61 @@
+"""
+Benchmark of the module source scanner against hcl2
+
+Every terraform file of the corpus is parsed with hcl2 and scanned with
+`scan_module_sources`, and both are timed. The corpus is made of a synthetic monorepo
+(see `monorepo.py`) with large files, and the `.tf` files of the given directories, e.g.
+checkouts of real-world infrastructure repos. The scanner's results are checked against
+hcl2 by `tests/test_modules.py`, which takes the same directories in `DUL_TF_CORPUS`.
+
+How to use (from the root of this repo):
+```
+python benchmarks/module_sources.py ~/src/infra ~/src/terraform-aws-modules
+```
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import hcl2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.monorepo import generate  # noqa: E402
+from dul.scripts.common import filesystem  # noqa: E402
+from dul.scripts.common.modules import scan_module_sources  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="module_sources")
+    parser.add_argument("dirs", nargs="*", help="Directories with terraform files to add")
+    args = parser.parse_args()
+
+    fallbacks = 0
+    errors = 0
+    hcl2_time = scan_time = 0.0
+    with tempfile.TemporaryDirectory(prefix="dul-sources-") as work_dir:
+        # large files, most of their content being resources the scanner skips
+        repo = generate(os.path.join(work_dir, "repo"), projects=20, modules=40, resources=100)
+        files = [file for dir in [repo] + args.dirs for file in filesystem.walk_files(dir, "*.tf")]
+        for file in files:
+            with open(file) as fp:
+                text = fp.read()
+            start = time.perf_counter()
+            if scan_module_sources(text) is None:
+                fallbacks += 1
+            scan_time += time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                hcl2.loads(text)
+            except Exception:
+                errors += 1
+            hcl2_time += time.perf_counter() - start
+
+    print(f"{len(files)} files: {fallbacks} left to hcl2, {errors} hcl2 errors")
+    print(
+        f"hcl2 {hcl2_time * 1000:.0f} ms, scanner {scan_time * 1000:.0f} ms "
+        f"({hcl2_time / max(scan_time, 1e-9):.0f}x faster)"
+    )
@@ -0,0 +1,135 @@
+"""
+Synthetic Terraform monorepo generator for the benchmarks
+
+The generated repo is a git repo with Atlantis projects under `projects/` calling
+shared modules under `modules/`. Modules are spread over `depth` levels, each module
+calling two modules of the next level, so that the module graph has nested and diamond
+dependencies. Every module and project also gets YAML and template noise files, a
+README with terraform-docs markers and an `atlantis.yaml` entry.
+
+How to use:
+```
+python benchmarks/monorepo.py /tmp/monorepo --projects 100 --modules 200 --depth 4
+```
+"""
+
+import argparse
+import os
+import random
+import subprocess
+
+begin_marker = "<!-- BEGIN_TF_DOCS -->"
+end_marker = "<!-- END_TF_DOCS -->"
+
+
+def _write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def _module_block(name: str, source: str) -> str:
+    return f'module "{name}" {{\n  source = "{source}"\n\n  name = var.name\n}}\n\n'
+
+
+def _resources(name: str, count: int) -> str:
+    res = ""
+    for i in range(count):
+        res += (
+            f'resource "aws_s3_bucket" "{name}_{i}" {{\n'
+            f'  bucket = "${{var.name}}-{name}-{i}"\n'
+            f"  tags = {{\n    Name = \"{name}\"\n    Index = {i}\n  }}\n}}\n\n"
+        )
+    return res
+
+
+def _noise(dir: str, count: int):
+    for i in range(count):
+        _write(os.path.join(dir, "config", f"values-{i}.yaml"), f"name: value-{i}\nindex: {i}\n")
+        _write(os.path.join(dir, "templates", f"policy-{i}.tpl"), '{"Version": "2012-10-17"}\n')
+
+
+def _readme(dir: str, title: str):
+    _write(os.path.join(dir, "README.md"), f"# {title}\n\n{begin_marker}\n{end_marker}\n")
+
+
+def generate(
+    root: str, projects: int = 10, modules: int = 20, depth: int = 3, noise: int = 2,
+    resources: int = 5, seed: int = 0
+) -> str:
+    """Function to generate a synthetic Terraform monorepo.
+
+    Args:
+        root: The directory to generate the repo in. Created if it doesn't exist.
+        projects: The number of Atlantis projects.
+        modules: The number of shared modules.
+        depth: The number of module levels. Projects call modules of the first level.
+        noise: The number of YAML and template files per module and project.
+        resources: The number of resources per module and project.
+        seed: The seed of the random module calls.
+
+    Returns:
+        The root directory of the generated repo.
+    """
+    rand = random.Random(seed)
+    depth = max(1, min(depth, modules))
+    levels: list[list[str]] = [[] for _ in range(depth)]
+    for i in range(modules):
+        levels[i % depth].append(f"modules/l{i % depth}/m{i}")
+
+    for level, dirs in enumerate(levels):
+        children = levels[level + 1] if level + 1 < depth else []
+        for dir in dirs:
+            main = ""
+            # two parents picking the same child make diamonds
+            for child in rand.sample(children, min(2, len(children))):
+                main += _module_block(os.path.basename(child), os.path.relpath(child, dir))
+            main += _resources(os.path.basename(dir), resources)
+            _write(os.path.join(root, dir, "main.tf"), main)
+            _write(os.path.join(root, dir, "variables.tf"), 'variable "name" {\n  type = string\n}\n')
+            _write(os.path.join(root, dir, "outputs.tf"), 'output "name" {\n  value = var.name\n}\n')
+            _readme(os.path.join(root, dir), dir)
+            _noise(os.path.join(root, dir), noise)
+
+    atlantis = "---\nversion: 3\nprojects:\n"
+    for i in range(projects):
+        dir = f"projects/{['dev', 'staging', 'prod'][i % 3]}/p{i}"
+        main = ""
+        for module in rand.sample(levels[0], min(3, len(levels[0]))):
+            main += _module_block(os.path.basename(module), os.path.relpath(module, dir))
+        # remote modules aren't part of the graph, but are still parsed
+        main += (
+            'module "vpc" {\n  source  = "terraform-aws-modules/vpc/aws"\n'
+            '  version = "3.0.0"\n}\n\n'
+        )
+        main += _resources(f"p{i}", resources)
+        _write(os.path.join(root, dir, "main.tf"), main)
+        _write(os.path.join(root, dir, "variables.tf"), 'variable "name" {\n  type = string\n}\n')
+        _readme(os.path.join(root, dir), dir)
+        _noise(os.path.join(root, dir), noise)
+        atlantis += (
+            f"  - dir: {dir}\n    autoplan:\n      when_modified:\n"
+            '        - "./*.tf"\n'
+        )
+    _write(os.path.join(root, "atlantis.yaml"), atlantis)
+
+    git = ["git", "-C", root, "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "Synthetic monorepo"], check=True)
+    return root
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="monorepo")
+    parser.add_argument("dir", help="Directory to generate the repo in")
+    parser.add_argument("--projects", type=int, default=10, help="Number of Atlantis projects")
+    parser.add_argument("--modules", type=int, default=20, help="Number of shared modules")
+    parser.add_argument("--depth", type=int, default=3, help="Number of module levels")
+    parser.add_argument("--noise", type=int, default=2, help="YAML/TPL files per directory")
+    parser.add_argument("--resources", type=int, default=5, help="Resources per directory")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random module calls")
+    args = parser.parse_args()
+    generate(
+        args.dir, args.projects, args.modules, args.depth, args.noise, args.resources, args.seed
+    )
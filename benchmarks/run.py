@@ -0,0 +1,259 @@
+"""
+Benchmarks of the dul scripts on synthetic Terraform monorepos
+
+Each script is run as a subprocess on repos of several sizes (see `monorepo.py`), with
+stub `terraform-docs` and `tfsec` binaries so that only the scripts' own overhead is
+measured. For each run the wall time, the number of executed commands (git, find and
+the stubs) and the peak memory are recorded, and the results are saved as JSON so that
+they can be compared between commits.
+
+How to use (from the root of this repo):
+```
+python benchmarks/run.py --sizes 10x20 100x200
+python benchmarks/run.py --compare benchmarks/results/<commit>.json
+```
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_root)
+
+from benchmarks.monorepo import generate  # noqa: E402
+
+# every executed command appends a line to the counter file
+counter_line = 'echo >> "$DUL_BENCH_COUNTER"'
+
+terraform_docs_stub = f"""#!{sys.executable}
+import os, sys
+with open(os.environ["DUL_BENCH_COUNTER"], "a") as fp:
+    fp.write("\\n")
+args = sys.argv[1:]
+if "--version" in args:
+    print("terraform-docs version v0.0.0-stub")
+    sys.exit()
+path = args[-1]
+names = sorted(f for f in os.listdir(path) if f.endswith(".tf"))
+content = "| Name |\\n|------|\\n" + "".join(f"| {{name}} |\\n" for name in names)
+if "--output-mode" not in args:
+    print(content)
+    sys.exit()
+readme = os.path.join(path, "README.md")
+with open(readme) as fp:
+    current = fp.read()
+begin, end = "{'<!-- BEGIN_TF_DOCS -->'}", "{'<!-- END_TF_DOCS -->'}"
+new = current[:current.find(begin)] + begin + "\\n" + content.rstrip() + "\\n" + end
+new += current[current.find(end) + len(end):]
+with open(readme, "w") as fp:
+    fp.write(new)
+"""
+
+tfsec_stub = f"""#!{sys.executable}
+import json, os, sys
+with open(os.environ["DUL_BENCH_COUNTER"], "a") as fp:
+    fp.write("\\n")
+args = sys.argv[1:]
+if "--version" in args:
+    print("v0.0.0-stub")
+    sys.exit()
+path = args[-1]
+results = [{{
+    "rule_id": "AVD-AWS-0086",
+    "long_id": "aws-s3-block-public-acls",
+    "rule_description": "S3 Access block should block public ACL",
+    "severity": "LOW",
+    "description": "No public access block so not blocking public acls",
+    "links": [],
+    "location": {{"filename": os.path.join(os.path.abspath(path), "main.tf"),
+                 "start_line": 1, "end_line": 3}},
+}}]
+print(json.dumps({{"results": results}}))
+"""
+
+
+def _shim(real: str) -> str:
+    return f'#!/bin/sh\n{counter_line}\nexec {real} "$@"\n'
+
+
+def make_bin(dir: str) -> str:
+    """Function to create the stub binaries and the command counting shims.
+
+    Args:
+        dir: The directory to create the binaries in.
+
+    Returns:
+        The directory to prepend to `PATH`.
+    """
+    bin = os.path.join(dir, "bin")
+    os.makedirs(bin, exist_ok=True)
+    files = {"terraform-docs": terraform_docs_stub, "tfsec": tfsec_stub}
+    for name in ["git", "find"]:
+        files[name] = _shim(shutil.which(name))
+    for name, content in files.items():
+        with open(os.path.join(bin, name), "w") as fp:
+            fp.write(content)
+        os.chmod(os.path.join(bin, name), 0o755)
+    return bin
+
+
+def cases(repo: str, cache_dir: str) -> list[tuple[str, list[str], bool]]:
+    """Function to get the benchmarked commands, in the order they are run, and wether
+    the caches are cleared before each run. The cache files are kept in `cache_dir`,
+    outside of the repo."""
+    python = sys.executable
+    populate = [
+        python, "-m", "dul.scripts.atlantis.populate_config",
+        "--cache-file", os.path.join(cache_dir, "hcl.json"),
+    ]
+    docs = [
+        python, "-m", "dul.scripts.terraform.docs", repo,
+        "--cache-file", os.path.join(cache_dir, "terraform-docs.json"),
+    ]
+    tfsec = [
+        python, "-m", "dul.scripts.terraform.tfsec", repo, "--severity", "HIGH",
+        "--cache-file", os.path.join(cache_dir, "tfsec.json"),
+    ]
+    return [
+        ("populate_config", populate + ["--no-cache"], False),
+        ("populate_config --check cold", populate + ["--check"], True),
+        ("populate_config --check cached", populate + ["--check"], False),
+        ("populate_config --check -j 4 no-cache",
+         populate + ["--check", "--no-cache", "-j", "4"], False),
+        ("terraform-docs --local", docs + ["--local", "--no-cache"], False),
+        ("terraform-docs check cold", docs, True),
+        ("terraform-docs check cached", docs, False),
+        ("tfsec no-cache", tfsec + ["--no-cache"], False),
+        ("tfsec cold", tfsec, True),
+        ("tfsec cached", tfsec, False),
+        ("filesystem.find_files", [
+            python, "-c",
+            "from dul.scripts.common.filesystem import find_files; find_files('.', '*.tf')",
+        ], False),
+        ("git.git_find_files", [
+            python, "-c",
+            "from dul.scripts.common.git import git_find_files; "
+            "git_find_files('.', ['-name', '*.tf'])",
+        ], False),
+    ]
+
+
+def measure(cmd: list[str], cwd: str, env: dict) -> dict:
+    """Function to run a command and measure it.
+
+    Returns:
+        The wall time in seconds, the number of executed commands, the peak memory in
+        KiB of the command and its children, and the return code.
+    """
+    open(env["DUL_BENCH_COUNTER"], "w").close()
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=output, stderr=output)
+        # the rusage of this very process, its children included
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            output.seek(0)
+            sys.stderr.write(output.read().decode(errors="replace")[-2000:])
+    with open(env["DUL_BENCH_COUNTER"]) as fp:
+        subprocesses = fp.read().count("\n")
+    return {
+        "wall": wall,
+        "subprocesses": subprocesses,
+        "max_rss_kb": rusage.ru_maxrss,
+        "returncode": process.returncode,
+    }
+
+
+def run(sizes: list[str], depth: int, repeat: int, work_dir: str) -> list[dict]:
+    bin = make_bin(work_dir)
+    env = dict(os.environ)
+    env["PATH"] = bin + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = package_root
+    env["DUL_BENCH_COUNTER"] = os.path.join(work_dir, "counter")
+    env.pop("DUL_TRACE", None)
+
+    results = []
+    for size in sizes:
+        projects, modules = map(int, size.split("x"))
+        repo = generate(os.path.join(work_dir, size), projects, modules, depth)
+        cache_dir = os.path.join(work_dir, f"{size}-cache")
+        for name, cmd, cold in cases(repo, cache_dir):
+            runs = []
+            for _ in range(repeat):
+                if cold:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                runs.append(measure(cmd, repo, env))
+            best = min(runs, key=lambda r: r["wall"])
+            result = {"size": size, "case": name, **best}
+            results.append(result)
+            print(
+                f"{size:>10}  {name:<40} {best['wall']:>8.3f}s {best['subprocesses']:>6} cmds "
+                f"{best['max_rss_kb'] / 1024:>8.1f} MiB"
+                + ("" if best["returncode"] == 0 else f"  exit {best['returncode']}")
+            )
+    return results
+
+
+def commit() -> str:
+    sub = subprocess.run(
+        ["git", "-C", package_root, "rev-parse", "--short", "HEAD"],
+        capture_output=True, text=True,
+    )
+    return sub.stdout.strip() or "unknown"
+
+
+def compare(results: list[dict], baseline_file: str):
+    with open(baseline_file) as fp:
+        baseline = {(r["size"], r["case"]): r for r in json.load(fp)["results"]}
+    print(f"\nCompared to {baseline_file}:")
+    for r in results:
+        base = baseline.get((r["size"], r["case"]))
+        if base is None or not base["wall"]:
+            continue
+        print(
+            f"{r['size']:>10}  {r['case']:<40} {r['wall'] / base['wall']:>7.2f}x wall "
+            f"{r['subprocesses'] - base['subprocesses']:>+6} cmds "
+            f"{(r['max_rss_kb'] - base['max_rss_kb']) / 1024:>+8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    parser.add_argument(
+        "--sizes", nargs="+", default=["10x20", "100x200"],
+        help="Repo sizes as <projects>x<modules>. 10x20 and 100x200 if not set"
+    )
+    parser.add_argument("--depth", type=int, default=4, help="Number of module levels")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the fastest is kept")
+    parser.add_argument(
+        "--output", default=None,
+        help="Results file. Defaults to benchmarks/results/<commit>.json"
+    )
+    parser.add_argument("--compare", default=None, help="Results file to compare to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="dul-bench-") as work_dir:
+        results = run(args.sizes, args.depth, max(1, args.repeat), work_dir)
+
+    output = args.output or os.path.join(package_root, "benchmarks", "results", f"{commit()}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump({
+            "commit": commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, fp, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
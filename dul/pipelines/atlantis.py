@@ -1,22 +1,15 @@
 from dagger.api.gen import Client, Container
 
-from .generic import random_string, scripts_dir
+from .generic import with_scripts
 
 
 def populate_config(
-        client: Client, container: Container, root: str
+        client: Client, container: Container, root: str,
+        random_mount: bool = False,
 ) -> Container:
-    mnt_path = f"/{random_string(8)}-scripts"
-
     return (
-        container.
-        with_mounted_directory(
-            mnt_path,
-            client.host().
-            directory(scripts_dir)
-        ).
+        with_scripts(client, container, random_mount).
         with_workdir(root).
-        with_env_variable("PYTHONPATH", mnt_path).
         with_entrypoint("python").
-        with_exec(["-m", "atlantis.populate_config", "--check"])
+        with_exec(["-m", "dul.scripts.atlantis.populate_config", "--check"])
     )
@@ -1,20 +1,30 @@
+import functools
 import inspect
 import os
 import platform
 import random
 import string
+import sys
+import weakref
+from typing import Callable, Optional
 
 import structlog
 from dagger.api.gen import Client, Container, Directory
 
-from dul.scripts.common.structlogging import *
+from dul.scripts.common.structlogging import configure
 
 log = structlog.get_logger()
 
 scripts_dir = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)),
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
     "scripts"
 )
+# only the files the scripts need are uploaded to the engine
+scripts_include = ["**/*.py"]
+scripts_exclude = ["**/__pycache__", "**/.*"]
+
+# scripts directory of each client, keyed by id with a weak reference to the client
+_scripts: dict[int, tuple[weakref.ref, Directory]] = {}
 
 
 def random_string(n: int) -> str:
@@ -25,33 +35,123 @@ def random_string(n: int) -> str:
     )
 
 
+def scripts(client: Client) -> Directory:
+    """Function to get the scripts directory, uploaded once per client and shared by
+    all the steps using it."""
+    key = id(client)
+    cached = _scripts.get(key)
+    if cached is not None and cached[0]() is client:
+        return cached[1]
+
+    directory = client.host().directory(
+        scripts_dir, include=scripts_include, exclude=scripts_exclude
+    )
+    _scripts[key] = (weakref.ref(client, lambda _: _scripts.pop(key, None)), directory)
+    return directory
+
+
+def mount_path(name: str, random: bool = False) -> str:
+    """Function to get the path a directory is mounted at in a container.
+
+    The path is stable by default, so that the exec steps using it hit the layer
+    cache from one run to the next. A random path is only used on request.
+    """
+    if random:
+        return f"/{random_string(8)}-{name}"
+    return f"/dul/{name}"
+
+
+def with_scripts(client: Client, container: Container, random: bool = False) -> Container:
+    """Function to mount the scripts in a container, so that they can be run with
+    `python -m dul.scripts.<module>`."""
+    mnt_path = mount_path("lib", random)
+    return (
+        container.
+        with_mounted_directory(f"{mnt_path}/dul/scripts", scripts(client)).
+        with_env_variable("PYTHONPATH", mnt_path)
+    )
+
+
 def locally() -> bool:
     return platform.system() == "Darwin"
 
 
 def init(
-    client: Client, image_name: str, src_dir: Directory = None
+    client: Client, image_name: str, src_dir: Directory = None,
+    random_mount: bool = False,
 ) -> tuple[Container, str]:
-    cnt_mnt_dir = f"/{random_string(8)}-src"
+    configure()
+    cnt_mnt_dir = mount_path("src", random_mount)
     pipeline = (
         client.container().
         from_(image_name)
     )
 
-    log.info("Initializing pipeline", job=get_job_name(), image=image_name)
+    with job(get_job_name(), "init"):
+        log.info("Initializing pipeline", image=image_name)
 
-    if src_dir is not None:
-        log.info("Mounting source directory", job=get_job_name(), image=image_name, mount=cnt_mnt_dir)
-        pipeline = pipeline.with_mounted_directory(cnt_mnt_dir, src_dir)
+        if src_dir is not None:
+            log.info("Mounting source directory", image=image_name, mount=cnt_mnt_dir)
+            pipeline = pipeline.with_mounted_directory(cnt_mnt_dir, src_dir)
 
     return pipeline, cnt_mnt_dir
 
 
-def get_job_name():
-    return inspect.stack()[2][3]
-
-def get_module_name():
-    return inspect.stack()[1][3]
+class job:
+    """Context manager and decorator setting the job and module names of the pipeline
+    steps created within it.
+
+    The names are bound with `structlog.contextvars`, so they are added to every log
+    entry and follow asyncio tasks, each task getting a copy of its parent's context.
+    A name left to None keeps its current value.
+    """
+
+    def __init__(self, name: Optional[str] = None, module: Optional[str] = None):
+        self.name = name
+        self.module = module
+        self._tokens: list[dict] = []
+
+    def __enter__(self) -> "job":
+        names = {"job": self.name, "module": self.module}
+        self._tokens.append(structlog.contextvars.bind_contextvars(
+            **{k: v for k, v in names.items() if v is not None}
+        ))
+        return self
+
+    def __exit__(self, *exc):
+        structlog.contextvars.reset_contextvars(**self._tokens.pop())
+
+    def __call__(self, func: Callable) -> Callable:
+        # a fresh context per call, so that the decorated function can run concurrently
+        name = self.name or func.__name__
+        module = self.module
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with job(name, module):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with job(name, module):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def get_job_name() -> str:
+    """Function to get the current job name, guessed from the caller's caller when it
+    isn't set by `job`."""
+    name = structlog.contextvars.get_contextvars().get("job")
+    return name if name is not None else sys._getframe(2).f_code.co_name
+
+
+def get_module_name() -> str:
+    """Function to get the current module name, guessed from the caller when it isn't
+    set by `job`."""
+    name = structlog.contextvars.get_contextvars().get("module")
+    return name if name is not None else sys._getframe(1).f_code.co_name
 
 
 # async def preserve_workdir(func: callable):
@@ -1,9 +1,7 @@
 import structlog
 from dagger.api.gen import Container
 
-from dul.scripts.common.structlogging import *
-
-from .generic import get_job_name, get_module_name
+from .generic import get_job_name, job
 
 log = structlog.get_logger()
 
@@ -13,22 +11,14 @@ def curl(
     url: str, options: str = ""
 ) -> Container:
 
-    if len(url) == 0:
-        log.warning(
-            "URL is not defined",
-            job=get_job_name(),
-            module=get_module_name(),
-            url=url,
-            options=options
-        )
-        return container
+    with job(get_job_name(), "curl"):
+        if len(url) == 0:
+            log.warning("URL is not defined", url=url, options=options)
+            return container
 
-    log.info(
-        "Initializing module", job=get_job_name(),
-        module=get_module_name(), url=url, options=options
-    )
+        log.info("Initializing module", url=url, options=options)
 
-    return (
-        container.
-        with_exec(["curl", url] + ([options] if len(options) > 0 else []))
-    )
+        return (
+            container.
+            with_exec(["curl", url] + ([options] if len(options) > 0 else []))
+        )
@@ -0,0 +1,52 @@
+from enum import Enum
+
+import structlog
+from dagger.api.gen import Container
+
+from .generic import get_job_name, job
+
+log = structlog.get_logger()
+
+# command prefix of each package manager, in the order they are applied
+managers = {
+    "apk": lambda action: ["apk", action, "--update", "--no-cache"],
+    "pip": lambda action: ["pip", action],
+}
+
+
+class PackagePlan:
+    """Builder collecting the packages to install or uninstall in a container.
+
+    Packages are de-duplicated and applied with a single exec per package manager and
+    action, with a sorted package list, so that the layer cache key only depends on
+    the set of packages requested.
+
+    Example:
+        PackagePlan(container).apk(APKActions.INSTALL, "git").pip(PIPActions.INSTALL, "pyyaml").apply()
+    """
+
+    def __init__(self, container: Container):
+        self.container = container
+        self._packages: dict[tuple[str, Enum], set[str]] = {}
+
+    def _add(self, manager: str, action: Enum, packages: tuple[str, ...]) -> "PackagePlan":
+        self._packages.setdefault((manager, action), set()).update(packages)
+        return self
+
+    def apk(self, action: Enum, *packages: str) -> "PackagePlan":
+        return self._add("apk", action, packages)
+
+    def pip(self, action: Enum, *packages: str) -> "PackagePlan":
+        return self._add("pip", action, packages)
+
+    def apply(self) -> Container:
+        container = self.container
+        for manager, command in managers.items():
+            # actions are applied in the order they were first requested
+            for (name, action), packages in self._packages.items():
+                if name != manager or not packages:
+                    continue
+                with job(get_job_name(), manager):
+                    log.info("Initializing module", action=action.name, packages=sorted(packages))
+                    container = container.with_exec(command(action.value) + sorted(packages))
+        return container
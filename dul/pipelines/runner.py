@@ -0,0 +1,184 @@
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import structlog
+from dagger.api.gen import Client, Container
+
+from dul.scripts.common.structlogging import configure, span
+
+from .generic import job
+
+log = structlog.get_logger()
+
+
+@dataclass
+class Job:
+    """A pipeline job.
+
+    Attributes:
+        name: The unique name of the job.
+        func: Function building the job's container from the client, or coroutine
+              function running it. Returned containers are executed by the runner.
+        needs: The names of the jobs that must succeed before this one starts.
+    """
+
+    name: str
+    func: Callable[[Client], Union[Container, Awaitable[Any]]]
+    needs: list[str] = field(default_factory=list)
+
+
+@dataclass
+class JobResult:
+    name: str
+    status: str = "pending"
+    duration: float = 0.0
+    error: Optional[BaseException] = None
+
+
+def _check(jobs: list[Job]):
+    names = {j.name for j in jobs}
+    if len(names) != len(jobs):
+        raise ValueError("Job names must be unique")
+    for j in jobs:
+        unknown = set(j.needs) - names
+        if unknown:
+            raise ValueError(f"Job {j.name} needs unknown jobs: {sorted(unknown)}")
+
+    # depth-first search for dependency cycles
+    needs = {j.name: j.needs for j in jobs}
+    done: set[str] = set()
+    path: list[str] = []
+
+    def visit(name: str):
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f"Job dependency cycle: {' -> '.join(cycle)}")
+        if name in done:
+            return
+        path.append(name)
+        for dep in needs[name]:
+            visit(dep)
+        path.pop()
+        done.add(name)
+
+    for name in needs:
+        visit(name)
+
+
+class Runner:
+    """Runs pipeline jobs concurrently on a shared client, each job starting as soon as
+    the jobs it needs have succeeded.
+
+    With `fail_fast`, the first failure cancels all the running and pending jobs.
+    Otherwise every job that doesn't depend on a failed one runs to completion.
+    """
+
+    def __init__(self, client: Client, jobs: list[Job], limit: int = 4, fail_fast: bool = True):
+        _check(jobs)
+        self.client = client
+        self.jobs = jobs
+        self.limit = max(1, limit)
+        self.fail_fast = fail_fast
+        self.results = {j.name: JobResult(j.name) for j in jobs}
+        self._needs = {j.name: j.needs for j in jobs}
+
+    def _needs_failed(self, j: Job) -> bool:
+        """Helper function to check if a job transitively needs a failed job."""
+        stack = list(j.needs)
+        seen: set[str] = set()
+        while stack:
+            name = stack.pop()
+            if name in seen:
+                continue
+            if self.results[name].status == "failed":
+                return True
+            seen.add(name)
+            stack.extend(self._needs[name])
+        return False
+
+    async def _execute(self, j: Job):
+        with job(j.name), span(f"job {j.name}", needs=j.needs):
+            res = j.func(self.client)
+            if inspect.isawaitable(res):
+                res = await res
+            if isinstance(res, Container):
+                code = await res.exit_code()
+                if code:
+                    raise RuntimeError(f"Exit code {code}")
+
+    async def _run(self, j: Job, tasks: dict[str, asyncio.Task], semaphore: asyncio.Semaphore):
+        result = self.results[j.name]
+        for dep in j.needs:
+            try:
+                await asyncio.shield(tasks[dep])
+            except asyncio.CancelledError:
+                # in fail-fast mode, the failed job cancels its dependents before it is done
+                if tasks[dep].cancelled() or self._needs_failed(j):
+                    result.status = "skipped"
+                    return
+                raise
+            if self.results[dep].status != "success":
+                result.status = "skipped"
+                return
+
+        async with semaphore:
+            result.status = "running"
+            log.info("Starting job", job=j.name)
+            start = time.monotonic()
+            try:
+                await self._execute(j)
+                result.status = "success"
+            except asyncio.CancelledError:
+                result.status = "cancelled"
+                raise
+            except Exception as exc:
+                result.status = "failed"
+                result.error = exc
+                log.error("Job failed", job=j.name, error=str(exc))
+            finally:
+                result.duration = time.monotonic() - start
+
+        if result.status == "failed" and self.fail_fast:
+            for name, task in tasks.items():
+                if name != j.name and not task.done():
+                    task.cancel()
+
+    async def run(self) -> bool:
+        """Function to run all the jobs and print a summary.
+
+        Returns:
+            Wether all the jobs succeeded.
+        """
+        configure()
+        semaphore = asyncio.Semaphore(self.limit)
+        tasks: dict[str, asyncio.Task] = {}
+        for j in self.jobs:
+            tasks[j.name] = asyncio.create_task(self._run(j, tasks, semaphore))
+        start = time.monotonic()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for name, task in tasks.items():
+            if task.cancelled() and self.results[name].status in ("pending", "running"):
+                self.results[name].status = "cancelled"
+        self.summary(time.monotonic() - start)
+        return all(r.status == "success" for r in self.results.values())
+
+    def summary(self, total: float):
+        width = max([len("job")] + [len(name) for name in self.results])
+        print(f"{'job':<{width}}  {'status':<9}  {'duration':>9}")
+        for r in self.results.values():
+            print(f"{r.name:<{width}}  {r.status:<9}  {r.duration:>8.2f}s")
+        print(f"{'total':<{width}}  {'':<9}  {total:>8.2f}s")
+
+
+async def run(
+    client: Client, jobs: list[Job], limit: int = 4, fail_fast: bool = True
+) -> bool:
+    """Function to run pipeline jobs concurrently, see `Runner`.
+
+    Returns:
+        Wether all the jobs succeeded.
+    """
+    return await Runner(client, jobs, limit, fail_fast).run()
@@ -1,65 +1,125 @@
-import os
-
-from dagger.api.gen import Client, Container
-
-from .generic import random_string, scripts_dir
-from .http import curl
+import structlog
+from dagger.api.gen import Client, Container, File
+
+from .alpine import APKActions
+from .generic import job, with_scripts
+from .packages import PackagePlan
+
+log = structlog.get_logger()
+
+bin_path = "/usr/bin"
+downloads_path = "/var/cache/dul/downloads"
+# image the tools are fetched in, pinned so that the fetch layers only depend on the
+# tool versions. Its busybox provides tar and unzip
+fetch_image = "alpine:3.17.1"
+
+docs_cache_path = "/var/cache/dul/terraform-docs"
+tfsec_cache_path = "/var/cache/dul/tfsec"
+
+
+# release artifact URL and unpack command of each tool
+tools = {
+    "terraform": (
+        "https://releases.hashicorp.com/terraform/{version}/terraform_{version}_linux_amd64.zip",
+        "unzip -o -d {out} {archive}",
+    ),
+    "tfsec": (
+        "https://github.com/aquasecurity/tfsec/releases/download/v{version}/tfsec-linux-amd64",
+        "cp {archive} {out}/tfsec",
+    ),
+    "terraform-docs": (
+        "https://terraform-docs.io/dl/v{version}/terraform-docs-v{version}-linux-amd64.tar.gz",
+        "tar -xzf {archive} -C {out} terraform-docs",
+    ),
+}
+
+
+def _fetch(container: Container, name: str, version: str, client: Client = None) -> File:
+    # with a client, the tool is fetched in a fixed container rather than in
+    # `container`, so that changes to `container` don't invalidate the fetch, and the
+    # release artifact is downloaded once into a version keyed cache volume. Otherwise
+    # it is downloaded in `container` on every build. The binary is unpacked outside of
+    # the download directory so that it can be copied as a single file
+    url, unpack = tools[name]
+    url = url.format(version=version)
+    cache_path = f"{downloads_path}/{name}"
+    archive = f"{cache_path}/{url.rsplit('/', 1)[-1]}"
+    out = f"/tmp/dul-{name}"
+    script = " && ".join([
+        f"mkdir -p {out} {cache_path}",
+        f"(test -s {archive} || (curl -sSLo {archive}.part {url} && mv {archive}.part {archive}))",
+        unpack.format(archive=archive, out=out),
+        f"chmod +x {out}/{name}",
+    ])
+
+    with job(module=f"fetch {name}"):
+        log.info("Initializing module", tool=name, version=version, url=url)
+
+        if client is not None:
+            container = (
+                PackagePlan(client.container().from_(fetch_image)).
+                apk(APKActions.INSTALL, "curl").
+                apply().
+                with_mounted_cache(cache_path, client.cache_volume(f"dul-{name}-{version}"))
+            )
+        return container.with_exec(["sh", "-c", script]).file(f"{out}/{name}")
+
+
+def install(container: Container, version: str, client: Client = None):
+    return container.with_file(
+        f"{bin_path}/terraform", _fetch(container, "terraform", version, client)
+    )
 
 
-def install(container: Container, version: str):
-    return (
-        curl(
-            container,
-            f"https://releases.hashicorp.com/terraform/{version}/terraform_{version}_linux_amd64.zip",
-            options="-sSLoterraform.zip"
-        ).
-        with_exec(["unzip", "terraform.zip"]).
-        with_exec(["chmod", "+x", "terraform"]).
-        with_exec(["mv", "terraform", "/usr/bin/"])
+def install_tfsec(container: Container, version: str, client: Client = None):
+    return container.with_file(
+        f"{bin_path}/tfsec", _fetch(container, "tfsec", version, client)
     )
 
 
-def install_tfsec(container: Container, version: str):
-    return (
-        curl(
-            container,
-            f"https://github.com/aquasecurity/tfsec/releases/download/v{version}/tfsec-linux-amd64",
-            options="-sSLotfsec"
-        ).
-        with_exec(["chmod", "+x", "tfsec"]).
-        with_exec(["mv", "tfsec", "/usr/bin/"])
+def install_docs(container: Container, version: str, client: Client = None):
+    return container.with_file(
+        f"{bin_path}/terraform-docs", _fetch(container, "terraform-docs", version, client)
     )
 
 
-def install_docs(container: Container, version: str):
-    return (
-        curl(
-            container,
-            f"https://terraform-docs.io/dl/v{version}/terraform-docs-v{version}-linux-amd64.tar.gz",
-            options="-sSLoterraform-docs.tar.gz"
-        ).
-        with_exec(["tar", "-xzf", "terraform-docs.tar.gz"]).
-        with_exec(["chmod", "+x", "terraform-docs"]).
-        with_exec(["mv", "terraform-docs", "/usr/bin/"])
-    )
+def toolchain(
+    client: Client, base: Container, terraform: str = None,
+    tfsec: str = None, docs: str = None,
+) -> Container:
+    # each tool is fetched in its own branch, so that the branches are evaluated
+    # concurrently and bumping a version only rebuilds that branch. Only the binaries
+    # are copied into `base`
+    versions = {"terraform": terraform, "tfsec": tfsec, "terraform-docs": docs}
+    files = {
+        name: _fetch(base, name, version, client)
+        for name, version in versions.items() if version is not None
+    }
+
+    container = base
+    for name, file in files.items():
+        container = container.with_file(f"{bin_path}/{name}", file)
+    return container
 
 
 def docs(
         client: Client, container: Container,
-        root: str, local: bool = False,
+        root: str, local: bool = False, cache: bool = True,
+        random_mount: bool = False,
 ) -> Container:
-    mnt_path = f"/{random_string(8)}-scripts"
+    args = ["-m", "dul.scripts.terraform.docs", root] + (["-l"] if local else [])
+
+    if cache:
+        # the manifest outlives the pipeline on a cache volume
+        container = container.with_mounted_cache(
+            docs_cache_path, client.cache_volume("dul-terraform-docs")
+        )
+        args += ["--cache-file", f"{docs_cache_path}/terraform-docs.json"]
 
     return (
-        container.
-        with_mounted_directory(
-            mnt_path,
-            client.host().
-            directory(scripts_dir)
-        ).
-        with_env_variable("PYTHONPATH", mnt_path).
+        with_scripts(client, container, random_mount).
         with_entrypoint("python").
-        with_exec(["-m", "terraform.docs", root] + (["-l"] if local else []))
+        with_exec(args)
     )
 
 
@@ -71,19 +131,22 @@ def format(container: Container, root: str) -> Container:
     )
 
 
-def tfsec(client: Client, container: Container, root: str) -> Container:
-    mnt_path = f"/{random_string(8)}-scripts"
+def tfsec(
+        client: Client, container: Container,
+        root: str, severity: str = "LOW", cache: bool = True,
+        random_mount: bool = False,
+) -> Container:
+    args = ["-m", "dul.scripts.terraform.tfsec", root, "--severity", severity]
+
+    if cache:
+        # findings of unchanged roots are replayed from a cache volume
+        container = container.with_mounted_cache(
+            tfsec_cache_path, client.cache_volume("dul-tfsec")
+        )
+        args += ["--cache-file", f"{tfsec_cache_path}/tfsec.json"]
 
     return (
-        container.
-        with_mounted_directory(
-            mnt_path,
-            client.host().
-            directory(scripts_dir)
-        ).
-        with_entrypoint("bash").
-        with_exec([
-            os.path.join(mnt_path, "terraform", "tfsec.sh"),
-            "-d", root,
-        ])
+        with_scripts(client, container, random_mount).
+        with_entrypoint("python").
+        with_exec(args)
     )
@@ -8,125 +8,120 @@ How to use (from root of monorepo):
 # create virtual environment if not done yet
 python3 -m venv .venv
 source .venv/bin/activate
-pip install -r pip-requirements.txt
-pip install -r dev-requirements.txt
+pip install "dul[scripts]"
 # To update the configuration file:
-scripts/populate_atlantis_conf.py
+dul-atlantis-populate
 # To check the configuration file:
-scripts/populate_atlantis_conf.py --check
+dul-atlantis-populate --check
 ```
 
-See the `main` and `__main__` function for more information on how this script handles arguments.
+See the `main` and `cli` functions for more information on how this script handles arguments.
 You can also get information from:
 ```
-scripts/populate_atlantis_conf.py --help
+dul-atlantis-populate --help
 ```
 """
 
 import argparse
-from copy import deepcopy
-from os import chdir, getcwd, path
-from sys import exit
-from typing import Dict, List
-
-import hcl2
-from ruamel.yaml import YAML
-from ruamel.yaml.comments import CommentedSeq
-from ruamel.yaml.scalarstring import DoubleQuotedScalarString as SQ
-
-from common.git import git_ls_files, git_root_dir
-
-
-def _add_types_path(acc: List[Dict], dir: str, extension: str, recursive: bool = True) -> List[str]:
-    """Helper function to find files with a given `extension` in the directory `dir`, either
-    recursively or not. It appends the results as dictionnaries in the `acc` variable.
-
+import os
+import posixpath
+import tempfile
+import time
+from os import chdir, path
+from sys import exit, stderr, stdin
+from typing import IO, Callable, Dict, List, Optional, Set, Tuple
+
+from dul.scripts.common.git import (
+    GitIndex, git_changed_files, git_root_dir, match_pathspec, pathspec_prefix
+)
+from dul.scripts.common.modules import (
+    MODULE_FILE_TYPES, ModuleGraph, ModuleSourceCache, normalize_module_path
+)
+from dul.scripts.common.structlogging import configure, span
+from dul.scripts.common.watch import watch_files
+
+
+def _resolve_atlantis_project_path(graph: ModuleGraph, project_dir: str) -> List[str]:
+    """
     Args:
-        acc: The list of dictionnaries to populate.
-        dir: The directory of the terraform module to search.
-        extension: The single extension to search.
-        recursive: A boolean value indicating if the search should be recursive
+        graph: The module dependency graph shared by all projects.
+        project_dir: The main directory of the terraform project.
 
     Returns:
-        The list of files found.
+        The list dependency of path of the terraform project.
     """
-    search_path = dir + ("/**/*." if recursive else "/*.") + extension
-    files_list = git_ls_files([search_path])
-    if files_list:
-        acc.append({"type": extension, "path": search_path})
-    return files_list
+    closure = graph.closure(project_dir)
+    for cycle in closure.cycles:
+        print(f"Warning: module cycle in project {project_dir}: {' -> '.join(cycle)}", file=stderr)
+    return graph.when_modified(project_dir, closure)
 
 
-def _resolve_module_paths(acc: List[Dict], dir: str) -> None:
-    """
-    Args:
-        acc: The list of dictionnaries to populate.
-        dir: The directory of the terraform module.
+def _affected_projects(projects: List[Dict], changed_files: List[str]) -> Set[int]:
+    """Helper function to find the projects whose dependencies intersect the changed
+    files, based on their current "when_modified" block.
+
+    A file affects a project if it matches one of the project's globs, or if it is a
+    tracked file type inside one of the project's module directories (which could add
+    a new glob). Projects without "when_modified" are always affected.
 
-    Returns:
-        Nothing.
-    """
-    # tf files
-    tf_files = _add_types_path(acc, dir, "tf", False)
-    if not tf_files:
-        return
-    # YAML/YML files
-    _add_types_path(acc, dir, "yaml")
-    _add_types_path(acc, dir, "yml")
-    # TPL templates
-    _add_types_path(acc, dir, "tpl")
-
-    # modules
-    def _get_module_source(module: dict) -> str:
-        # module is a dictionnary with one key/value pair, where
-        # - the key is the module name
-        # - the values contain the module configuration
-
-        # get module configuration as 'dict'
-        kv = list(module.values())[0]
-        # extract the source path
-        source_path = kv.get("source")
-        return source_path
-
-    for file in tf_files:
-        with open(file, "r") as fp:
-            obj = hcl2.load(fp)
-            modules = obj.get("module", [])
-            res = [_get_module_source(module) for module in modules]
-            for mod in res:
-                acc.append({"type": "module", "path": mod})
-
-
-def _resolve_atlantis_project_path(project_dir: str) -> List[str]:
-    """
     Args:
-        dir: The main directory of the terraform project.
+        projects: The "projects" of the atlantis configuration file.
+        changed_files: The changed files, relative to the repo's root.
 
     Returns:
-        The list dependency of path of the terraform project.
+        The indexes of the affected projects.
     """
-    # get original working directory
-    CWD = getcwd()
-    chdir(project_dir)
-    index = 0
-    acc = [{"type": "module", "path": "."}]
-    while index < len(acc):
-        if acc[index].get("type") == "module":
-            dir = acc[index].get("path", "")
-            acc.pop(index)
-            _resolve_module_paths(acc, dir)
-        else:
-            index += 1
-    # reset original working directory
-    chdir(CWD)
-    # get all values from path keys in acc
-    res = [x.get("path", "") for x in acc]
-    res = list(set(res))
-    res.sort()
-    return res
-
-
-def _update_atlantis_project(atlantis_yaml: str, check: bool) -> int:
+    extensions = {"." + type for type, _ in MODULE_FILE_TYPES}
+    affected: Set[int] = set()
+    # reverse index: module directory -> projects, and module directory -> glob -> projects
+    dirs: Dict[str, Set[int]] = {}
+    globs: Dict[str, Dict[str, Set[int]]] = {}
+    for i, project in enumerate(projects):
+        when_modified = (project.get("autoplan") or {}).get("when_modified")
+        if not when_modified:
+            affected.add(i)
+            continue
+        for pattern in when_modified:
+            pattern = normalize_module_path(project.get("dir"), pattern)
+            dir = pathspec_prefix(pattern)
+            dirs.setdefault(dir, set()).add(i)
+            globs.setdefault(dir, {}).setdefault(pattern, set()).add(i)
+
+    for file in changed_files:
+        file = posixpath.normpath(file)
+        new_type = posixpath.splitext(file)[1] in extensions
+        dir = file
+        while dir:
+            dir = posixpath.dirname(dir)
+            if dir not in dirs:
+                continue
+            if new_type:
+                affected.update(dirs[dir])
+                continue
+            for pattern, indexes in globs[dir].items():
+                if not indexes <= affected and match_pathspec(pattern, file):
+                    affected.update(indexes)
+    return affected
+
+
+def _write_atomic(file: str, write: Callable[[IO[str]], None]) -> None:
+    """Helper function to replace a file atomically, keeping its permissions."""
+    dir = path.dirname(path.abspath(file))
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix=".atlantis-", suffix=".yaml")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            write(fp)
+        os.chmod(tmp, os.stat(file).st_mode & 0o7777)
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _update_atlantis_project(
+    atlantis_yaml: str, check: bool, graph: ModuleGraph,
+    changed_files: Optional[List[str]] = None
+) -> int:
     """Function to get the updated the "when_modified" block of all "projects"
     in the atlantis configuration file.
 
@@ -134,10 +129,17 @@ def _update_atlantis_project(atlantis_yaml: str, check: bool) -> int:
         atlantis_yaml: The path to atlantis' YAML configuration
         check: Wether to check if the updated configuration is the same as the
                current configuration file.
+        graph: The module dependency graph shared by all projects.
+        changed_files: If given, only the projects affected by these files are updated,
+                       the other ones are left untouched.
 
     Returns:
-        None
+        1 in check mode if any project's "when_modified" block is out of date, 0 otherwise.
     """
+    # imported here rather than at the top, so that the command starts fast
+    from ruamel.yaml import YAML
+    from ruamel.yaml.comments import CommentedSeq
+    from ruamel.yaml.scalarstring import DoubleQuotedScalarString as SQ
 
     def FSlist(paths: List[str]) -> CommentedSeq:
         # Helper function to create comment block-style lists
@@ -151,23 +153,99 @@ def _update_atlantis_project(atlantis_yaml: str, check: bool) -> int:
     yaml.indent(mapping=2, sequence=4, offset=2)
     with open(atlantis_yaml) as fp:
         data = yaml.load(fp)
-    original_data = deepcopy(data)
 
-    for project in data["projects"]:
+    projects = data["projects"]
+    if changed_files is not None:
+        affected = _affected_projects(projects, changed_files)
+        projects = [project for i, project in enumerate(projects) if i in affected]
+        print(f"{len(projects)} of {len(data['projects'])} projects affected by the changes.")
+
+    # resolve the modules of all projects at once, so that parsing is batched
+    graph.resolve([project.get("dir") for project in projects])
+    drifted = []
+    for project in projects:
         dir = project.get("dir")
-        paths = _resolve_atlantis_project_path(dir)
-        project["autoplan"]["when_modified"] = FSlist(paths)
-
-    if not check:
-        with open(atlantis_yaml, "w") as fp:
-            yaml.dump(data, fp)
-    else:
-        if original_data != data:
-            return 1
+        paths = _resolve_atlantis_project_path(graph, dir)
+        # the loaded list holds string subclasses, compared by value
+        if list(project["autoplan"].get("when_modified") or []) != paths:
+            drifted.append(dir)
+            project["autoplan"]["when_modified"] = FSlist(paths)
+
+    if drifted:
+        print("Projects out of date:" if check else "Projects updated:")
+        for dir in drifted:
+            print(f"  - {dir}")
+    if check:
+        return 1 if drifted else 0
+
+    # the file is left untouched when nothing changed, so that watchers and hooks
+    # don't see a modification
+    if drifted:
+        # quotes aren't preserved when loading, every list is written as a drifted one
+        for project in data["projects"]:
+            autoplan = project.get("autoplan") or {}
+            if autoplan.get("when_modified") is not None:
+                autoplan["when_modified"] = FSlist(list(autoplan["when_modified"]))
+        _write_atomic(atlantis_yaml, lambda fp: yaml.dump(data, fp))
     return 0
 
 
-def main(atlantis_yaml_file: str, check: bool) -> int:
+def _stat(file: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _watch(atlantis_yaml: str, graph: ModuleGraph, debounce: float, polling: bool) -> None:
+    """Function to keep the atlantis configuration up to date until interrupted.
+
+    The module graph is kept in memory: on each batch of changes, only the modules
+    containing changed files are resolved again, and only the projects affected by the
+    changes are updated. As in a single run, only the files tracked by git are taken
+    into account.
+
+    Args:
+        atlantis_yaml: The path to atlantis' YAML configuration.
+        graph: The module dependency graph shared by all projects.
+        debounce: The quiet period, in seconds, ending a batch of changes.
+        polling: Wether to poll for changes even if inotify is available.
+    """
+    root = graph.index.root
+    conf = path.relpath(path.realpath(atlantis_yaml), root).replace(path.sep, "/")
+    # the configuration as last written, to tell its own updates from the user's edits
+    written = _stat(atlantis_yaml)
+    print(f"Watching {root} for changes. Press Ctrl+C to stop.")
+    try:
+        for changes in watch_files(root, debounce, polling=polling):
+            start = time.perf_counter()
+            index = GitIndex.load(root)
+            changed_files: Optional[List[str]] = sorted(
+                file for file in changes - {conf} if file in index or file in graph.index
+            )
+            if conf in changes and _stat(atlantis_yaml) != written:
+                # e.g. a new project: every project is updated
+                changed_files = None
+            elif not changed_files:
+                continue
+            graph.invalidate(changed_files or [], index)
+            with span("atlantis.watch", changes=len(changes)):
+                _update_atlantis_project(atlantis_yaml, False, graph, changed_files)
+            written = _stat(atlantis_yaml)
+            if graph.cache is not None:
+                graph.cache.save()
+            print(f"Updated in {(time.perf_counter() - start) * 1000:.0f} ms.")
+    except KeyboardInterrupt:
+        pass
+
+
+def main(
+    atlantis_yaml_file: str, check: bool,
+    cache_file: Optional[str] = None, no_cache: bool = False, jobs: int = 1,
+    since: Optional[str] = None, changed_files: Optional[List[str]] = None,
+    watch: bool = False, debounce: float = 0.05, polling: bool = False
+) -> int:
     """The main function. It will launch the `_update_atlantis_project` function.
 
     Args:
@@ -177,6 +255,18 @@ def main(atlantis_yaml_file: str, check: bool) -> int:
                        the monorepo.
         check: Wether to check if the updated configuration is the same as the
                current configuration file.
+        cache_file: The path to the HCL parse cache. No cache is used if not given, so
+                    that nothing is written to the working tree by default.
+        no_cache: Wether to ignore the HCL parse cache.
+        jobs: The number of processes parsing terraform files.
+        since: If given, only the projects affected by the files changed since this git
+               ref are updated.
+        changed_files: If given, only the projects affected by these files, relative to
+                       the repo's root, are updated.
+        watch: Wether to keep updating the configuration as files change, until
+               interrupted.
+        debounce: The quiet period, in seconds, ending a batch of changes in watch mode.
+        polling: Wether to poll for changes in watch mode even if inotify is available.
     """
     # Get the repo's root directory
     github_root_dir = git_root_dir()
@@ -190,7 +280,27 @@ def main(atlantis_yaml_file: str, check: bool) -> int:
     if atlantis_yaml_file is None or not atlantis_yaml_file:
         atlantis_yaml_file = path.join(github_root_dir, "atlantis.yaml")
 
-    return_code = _update_atlantis_project(atlantis_yaml_file, check)
+    # a single `git ls-files` and module graph for the whole run
+    index = GitIndex.load(github_root_dir)
+    cache = None
+    if cache_file and not no_cache:
+        cache = ModuleSourceCache(cache_file)
+    graph = ModuleGraph(index, cache, jobs)
+
+    if since is not None:
+        changed_files = (changed_files or []) + git_changed_files(since)
+
+    try:
+        with span("atlantis.update", check=check, jobs=jobs):
+            return_code = _update_atlantis_project(atlantis_yaml_file, check, graph, changed_files)
+        if watch:
+            _watch(atlantis_yaml_file, graph, debounce, polling)
+    finally:
+        graph.close()
+    if cache is not None:
+        cache.prune(graph.index)
+        cache.save()
+        print(f"HCL parse cache: {cache.hits} hits, {cache.misses} misses.")
     if check and return_code == 0:
         print("All done! ✨ 🍰 ✨")
         print("Atlantis configuration is correct.")
@@ -201,8 +311,9 @@ def main(atlantis_yaml_file: str, check: bool) -> int:
     return return_code
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(prog="populate-atlantis")
+def cli(argv: Optional[List[str]] = None) -> int:
+    """Entry point of the `dul-atlantis-populate` command."""
+    parser = argparse.ArgumentParser(prog="dul-atlantis-populate")
     parser.add_argument(
         "--conf", help="Atlantis configuration file", default=None)
     parser.add_argument(
@@ -212,6 +323,68 @@ if __name__ == "__main__":
         + ".False if not set",
         action="store_true",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--cache-file",
+        help="HCL parse cache file, e.g. .git/dul/hcl.json. No cache is used if not set",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-cache",
+        default=False,
+        help="Parse every terraform file, ignoring the HCL parse cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes parsing terraform files. 1 if not set",
+    )
+    changes = parser.add_mutually_exclusive_group()
+    changes.add_argument(
+        "--since",
+        default=None,
+        help="Only update the projects affected by the files changed since this git ref",
+    )
+    changes.add_argument(
+        "--stdin",
+        default=False,
+        help="Only update the projects affected by the files listed on stdin, one per line"
+        + ", relative to the repo's root",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch",
+        default=False,
+        help="Keep updating the configuration as files change, until interrupted",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.05,
+        help="Quiet period in seconds ending a batch of changes in watch mode. 0.05 if not set",
+    )
+    parser.add_argument(
+        "--poll",
+        default=False,
+        help="Poll for changes in watch mode, even if inotify is available",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+    if args.watch and args.check:
+        parser.error("--watch can't be used with --check")
+
+    changed_files = None
+    if args.stdin:
+        changed_files = [line.strip() for line in stdin if line.strip()]
+
+    configure()
+    return main(
+        args.conf, args.check, args.cache_file, args.no_cache, args.jobs,
+        args.since, changed_files, args.watch, args.debounce, args.poll
+    )
+
 
-    exit(main(args.conf, args.check))
+if __name__ == "__main__":
+    exit(cli())
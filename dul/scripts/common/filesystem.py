@@ -1,11 +1,97 @@
 import fnmatch
 import os
+import re
+import subprocess
+from typing import Callable, Iterable, Iterator, Optional
 
+from .structlogging import count_subprocess, span
 
-def find_files(path, name: str) -> list[str]:
-    matches: list[str] = []
-    for root, _, filenames in os.walk(path):
-        for filename in fnmatch.filter(filenames, name):
-            matches.append(os.path.join(root, filename))
+# directories never worth descending into: provider caches and VCS metadata
+DEFAULT_EXCLUDES = (".terraform", ".git")
+
+
+def compile_patterns(patterns: Iterable[str]) -> Callable[[str], bool]:
+    """Function to compile shell-style patterns into a single name matcher.
+
+    Args:
+        patterns: Shell-style patterns, matched against whole names.
+
+    Returns:
+        A predicate telling wether a name matches one of the patterns.
+    """
+    patterns = list(patterns)
+    literals = {p for p in patterns if not any(c in p for c in "*?[")}
+    wildcards = [fnmatch.translate(p) for p in patterns if p not in literals]
+    if not wildcards:
+        return literals.__contains__
+    regex = re.compile("|".join(wildcards))
+    return lambda name: name in literals or regex.match(name) is not None
+
+
+def _gitignored(path: str) -> set[str]:
+    """Helper function to get the absolute paths of the files and directories ignored by
+    git under `path`. Empty if `path` isn't in a git repo."""
+    with span("command", cmd="git ls-files --ignored"):
+        count_subprocess()
+        sub = subprocess.run(
+            ["git", "-C", path, "ls-files", "-z", "--others", "--ignored",
+             "--exclude-standard", "--directory"],
+            capture_output=True,
+        )
+    if sub.returncode != 0:
+        return set()
+    return {
+        os.path.normpath(os.path.join(path, os.fsdecode(p)))
+        for p in sub.stdout.split(b"\0") if p
+    }
 
-    return matches
+
+def walk_files(
+    path: str, *names: str,
+    excludes: Iterable[str] = DEFAULT_EXCLUDES,
+    gitignore: bool = False,
+    prune: Optional[Callable[[os.DirEntry], bool]] = None,
+) -> Iterator[str]:
+    """Function to find files by name, yielding them as soon as they are found.
+
+    Args:
+        path: The directory to search.
+        names: Shell-style patterns the file names are matched against.
+        excludes: Shell-style patterns of directory names not to descend into.
+        gitignore: Wether to skip the files and directories ignored by git.
+        prune: Extra predicate on directory entries not to descend into.
+
+    Returns:
+        An iterator over the paths of the matching files.
+    """
+    match = compile_patterns(names)
+    excluded = compile_patterns(excludes)
+    ignored = _gitignored(path) if gitignore else set()
+
+    stack = [path]
+    while stack:
+        dir = stack.pop()
+        try:
+            entries = os.scandir(dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if ignored and os.path.normpath(entry.path) in ignored:
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    # same as `os.walk`, symlinks to directories aren't followed
+                    if entry.is_symlink() or excluded(entry.name):
+                        continue
+                    if prune is None or not prune(entry):
+                        stack.append(entry.path)
+                elif match(entry.name):
+                    yield entry.path
+
+
+def find_files(path, name: str) -> list[str]:
+    return list(walk_files(path, name))
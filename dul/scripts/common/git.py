@@ -2,9 +2,17 @@
 Git helper functions in python
 """
 
+import bisect
+import fnmatch
+import hashlib
 import os
+import posixpath
+import re
 import subprocess
-from typing import List
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Pattern
+
+from .structlogging import count_subprocess, span
 
 
 def command_output(cmd: List[str]) -> str:
@@ -21,9 +29,11 @@ def command_output(cmd: List[str]) -> str:
         print("Command is empty.")
         exit(1)
     try:
-        sub = subprocess.run(
-            cmd, universal_newlines=True, capture_output=True, text=True, check=True
-        )
+        with span("command", cmd=" ".join(cmd[:4])):
+            count_subprocess()
+            sub = subprocess.run(
+                cmd, universal_newlines=True, capture_output=True, text=True, check=True
+            )
     except Exception as exc:
         print(":error:")
         print(exc)
@@ -73,13 +83,17 @@ def git_lfs_files() -> List[str]:
     return res
 
 
-def git_find_files(dir: str = ".", args: List[str] = []) -> List[str]:
+def git_find_files(
+    dir: str = ".", args: List[str] = [], index: Optional["GitIndex"] = None
+) -> List[str]:
     """Function to get the list of intersecting files matching the `find` command and
     `git lf-files`.
 
     Args:
         dir: The directory to search
         args: Extra arguments for the `find` command. See `man find`.
+        index: The index of the files tracked by git. A single `git ls-files` call is
+               made instead if not given.
 
     Returns:
         A list of files.
@@ -92,7 +106,216 @@ def git_find_files(dir: str = ".", args: List[str] = []) -> List[str]:
     files_find = list(filter(len, files_find))
     files_find = list(map(os.path.normpath, files_find))
     # get git files
-    files_git = git_ls_files([dir])
+    files_git = git_ls_files([dir]) if index is None else index.ls_files([dir])
     # intersection of `files_find` and `files_git`
     res = list(set(files_find) & set(files_git))
     return res
+
+
+_WILDCARDS = "*?["
+
+
+@lru_cache(maxsize=None)
+def _compile_pathspec(pathspec: str) -> Pattern:
+    # Git's default pathspec magic matches wildcards with `fnmatch` semantics where
+    # `*` also crosses `/`, which is exactly what `fnmatch.translate` produces
+    return re.compile(fnmatch.translate(pathspec), re.DOTALL)
+
+
+def _literal_prefix(pathspec: str) -> str:
+    """Helper function to get the part of a pathspec preceding its first wildcard."""
+    for i, c in enumerate(pathspec):
+        if c in _WILDCARDS or c == "\\":
+            return pathspec[:i]
+    return pathspec
+
+
+def pathspec_prefix(pathspec: str) -> str:
+    """Function to get the directory every file matching a pathspec is in.
+
+    Args:
+        pathspec: The pathspec, relative to the repo root.
+
+    Returns:
+        The directory, relative to the repo root. Empty for the root itself.
+    """
+    return posixpath.dirname(_literal_prefix(pathspec))
+
+
+def match_pathspec(pathspec: str, path: str) -> bool:
+    """Function to check if a file matches a pathspec the way `git ls-files` does.
+
+    Args:
+        pathspec: The pathspec, relative to the repo root.
+        path: The path of the file, relative to the repo root.
+
+    Returns:
+        Wether the file matches the pathspec.
+    """
+    # like git, a pathspec is matched literally before being matched as a glob
+    if not pathspec or path == pathspec or path.startswith(pathspec.rstrip("/") + "/"):
+        return True
+    if _literal_prefix(pathspec) == pathspec:
+        return False
+    return _compile_pathspec(pathspec).match(path) is not None
+
+
+def git_changed_files(ref: str) -> List[str]:
+    """Function to get the list of files changed in the working tree since a commit.
+
+    Args:
+        ref: The commit to compare the working tree to.
+
+    Returns:
+        The changed files, relative to the repo root.
+    """
+    cmd = ["git", "diff", "--name-only", "--no-renames", "-z", ref, "--"]
+    sub = command_output(cmd)
+    return list(filter(len, sub.split("\0")))
+
+
+class GitIndex:
+    """In-memory index of the files tracked by a git repo.
+
+    The file list is loaded once with `git ls-files -s -z` and kept sorted, so that
+    pathspec queries are answered by a prefix range lookup (narrowed down by file
+    extension when possible) instead of a `git ls-files` subprocess per query.
+    """
+
+    def __init__(self, root: str, paths: Iterable[str], blobs: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            root: The root directory of the git repo.
+            paths: The tracked files, relative to `root`.
+            blobs: The staged blob hashes of the tracked files, keyed by path.
+        """
+        self.root = os.path.realpath(root)
+        self._blobs: Dict[str, str] = blobs or {}
+        self._modified: Optional[set] = None
+        self._paths: List[str] = sorted(set(paths))
+        self._by_ext: Dict[str, List[str]] = {}
+        for p in self._paths:
+            _, ext = posixpath.splitext(p)
+            if ext:
+                self._by_ext.setdefault(ext[1:], []).append(p)
+
+    @classmethod
+    def load(cls, root: Optional[str] = None) -> "GitIndex":
+        """Function to build the index of a git repo with a single `git ls-files` call.
+
+        Args:
+            root: The root directory of the git repo. Determined from the current
+                  working directory if not given.
+
+        Returns:
+            The index of the repo's tracked files.
+        """
+        if root is None:
+            root = git_root_dir()
+        sub = command_output(["git", "-C", root, "ls-files", "-s", "-z"])
+        blobs = {}
+        for entry in filter(len, sub.split("\0")):
+            # <mode> SP <object> SP <stage> TAB <file>
+            info, _, file = entry.partition("\t")
+            blobs[file] = info.split(" ")[1]
+        return cls(root, blobs.keys(), blobs)
+
+    def blob_hash(self, path: str) -> Optional[str]:
+        """Function to get the git blob hash of the working tree version of a file.
+
+        The hash is taken from the index, unless the file is modified in the working
+        tree, in which case it is computed from the file content like `git hash-object`.
+
+        Args:
+            path: The path of the file, relative to the repo root.
+
+        Returns:
+            The blob hash, or None if the file is not tracked or doesn't exist.
+        """
+        if path not in self._blobs:
+            return None
+        if self._modified is None:
+            sub = command_output(["git", "-C", self.root, "ls-files", "-m", "-z"])
+            self._modified = set(filter(len, sub.split("\0")))
+        if path not in self._modified:
+            return self._blobs[path]
+        try:
+            with open(os.path.join(self.root, path), "rb") as fp:
+                content = fp.read()
+        except OSError:
+            return None
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, path: str) -> bool:
+        return self._range(self._paths, path)[:1] == [path]
+
+    def _prefix(self, cwd: Optional[str]) -> str:
+        rel = os.path.relpath(os.path.realpath(cwd or os.getcwd()), self.root)
+        return "" if rel == "." else rel.replace(os.sep, "/")
+
+    @staticmethod
+    def _range(paths: List[str], prefix: str) -> List[str]:
+        start = bisect.bisect_left(paths, prefix)
+        end = bisect.bisect_left(paths, prefix + "\U0010ffff")
+        return paths[start:end]
+
+    def _match_literal(self, pathspec: str) -> List[str]:
+        """Helper function to match the file or the directory a pathspec names."""
+        if pathspec == "":
+            return list(self._paths)
+        res = self._range(self._paths, pathspec.rstrip("/") + "/")
+        if not pathspec.endswith("/") and pathspec in self:
+            res.insert(0, pathspec)
+        return res
+
+    def _match(self, pathspec: str) -> List[str]:
+        """Helper function to match a single pathspec, relative to the repo root."""
+        # like git, a pathspec is matched literally first, so that a file named
+        # `[x].tf` is matched by the pathspec `[x].tf`
+        res = self._match_literal(pathspec)
+        prefix = _literal_prefix(pathspec)
+        if prefix == pathspec:
+            return res
+
+        candidates = self._paths
+        head, _, ext = pathspec.rpartition("*.")
+        if head and ext and _literal_prefix(ext) == ext and "/" not in ext:
+            candidates = self._by_ext.get(ext, [])
+        regex = _compile_pathspec(pathspec)
+        return res + [p for p in self._range(candidates, prefix) if regex.match(p)]
+
+    def ls_files(self, pathspecs: List[str] = [], cwd: Optional[str] = None) -> List[str]:
+        """Function to get the list of tracked files matching the given pathspecs, the
+        same way `git ls-files` would when executed from `cwd`.
+
+        Args:
+            pathspecs: Pathspecs relative to `cwd`. If no pathspecs are given all files
+                       under `cwd` are shown.
+            cwd: The directory the pathspecs are relative to. Defaults to the current
+                 working directory.
+
+        Returns:
+            The matching files, relative to `cwd` and sorted as git sorts them.
+        """
+        prefix = self._prefix(cwd)
+        matches = set()
+        for pathspec in pathspecs or [""]:
+            normalized = posixpath.normpath(posixpath.join(prefix, pathspec))
+            if normalized.startswith("../") or normalized == "..":
+                # same as `git ls-files`, which refuses pathspecs outside of the repo
+                print(":error:")
+                print(f"{pathspec}: '{normalized}' is outside repository at '{self.root}'")
+                exit(1)
+            if normalized == ".":
+                normalized = ""
+            elif pathspec.endswith("/"):
+                normalized += "/"
+            matches.update(self._match(normalized))
+        start = prefix + "/" if prefix else ""
+        return [
+            posixpath.relpath(p, prefix or ".") if not p.startswith(start) else p[len(start):]
+            for p in sorted(matches)
+        ]
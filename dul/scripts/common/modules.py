@@ -0,0 +1,645 @@
+"""
+Terraform module dependency graph helpers in python
+"""
+
+import json
+import os
+import posixpath
+import re
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .git import GitIndex
+from .structlogging import span
+
+# file types tracked for each module: (type, glob suffix)
+MODULE_FILE_TYPES = [
+    ("tf", "/*."),
+    ("yaml", "/**/*."),
+    ("yml", "/**/*."),
+    ("tpl", "/**/*."),
+]
+
+
+# terraform module source types, see https://developer.hashicorp.com/terraform/language/modules/sources
+_SOURCE_TYPES = [
+    ("local", re.compile(r"^\.\.?/")),
+    ("git", re.compile(r"^(git::|git@|github\.com/|bitbucket\.org/)")),
+    ("mercurial", re.compile(r"^hg::")),
+    ("s3", re.compile(r"^(s3::|[^/]*\.amazonaws\.com/)")),
+    ("gcs", re.compile(r"^(gcs::|www\.googleapis\.com/storage/)")),
+    ("http", re.compile(r"^https?://")),
+    ("registry", re.compile(r"^([^/:]+/)?[^/:]+/[^/:]+/[^/:]+(//.*)?$")),
+]
+
+
+def source_type(source: Optional[str]) -> str:
+    """Function to classify a module source.
+
+    Args:
+        source: The `source` attribute of a module call.
+
+    Returns:
+        One of `local`, `git`, `mercurial`, `s3`, `gcs`, `http`, `registry`, or `unknown`
+        for missing and interpolated sources.
+    """
+    if not isinstance(source, str) or "${" in source:
+        return "unknown"
+    for type, regex in _SOURCE_TYPES:
+        if regex.match(source):
+            return type
+    return "unknown"
+
+
+class ModuleNode(NamedTuple):
+    """A resolved terraform module.
+
+    Attributes:
+        dir: The module directory, relative to the repo root.
+        globs: The file-type globs of the module as (type, glob suffix) pairs.
+        tf_files: The module's terraform files, relative to the repo root.
+        children: The directories of the sourced local modules, relative to the repo root.
+    """
+
+    dir: str
+    globs: List[tuple]
+    tf_files: List[str]
+    children: List[str]
+
+
+class ModuleClosure(NamedTuple):
+    """The modules a project transitively depends on.
+
+    Attributes:
+        dirs: The module directories, project first, relative to the repo root.
+        cycles: The module cycles found, each as a list of directories starting and
+                ending with the same module.
+    """
+
+    dirs: List[str]
+    cycles: List[List[str]]
+
+
+def normalize_module_path(base: str, source: str) -> str:
+    """Function to normalize a module source relative to the repo root.
+
+    Args:
+        base: The directory containing the module call, relative to the repo root.
+        source: The `source` attribute of the module call.
+
+    Returns:
+        The normalized module path.
+    """
+    return posixpath.normpath(posixpath.join(base, source))
+
+
+def relative_module_path(path: str, start: str) -> str:
+    """Function to express a module path relative to a project directory the way it is
+    written in terraform sources, i.e. `.`, `./<dir>` or `../<dir>`.
+
+    Args:
+        path: The module path, relative to the repo root.
+        start: The project directory, relative to the repo root.
+
+    Returns:
+        The module path relative to `start`.
+    """
+    rel = posixpath.relpath(path, start)
+    if rel == "." or rel.startswith("../"):
+        return rel
+    return "./" + rel
+
+
+# tokens of the module source scanner at the top level and in module bodies, anything
+# else is skipped
+_TOKENS = re.compile(
+    r"""(?P<comment>\#[^\n]*|//[^\n]*|/\*.*?\*/)"""
+    r"""|(?P<heredoc><<-?[ \t]*(?P<marker>[A-Za-z_][\w-]*)[ \t]*\r?\n)"""
+    r"""|(?P<literal>"[^"\\$%\n]*")"""
+    r"""|(?P<string>")"""
+    r"""|(?P<open>[{\[(])"""
+    r"""|(?P<close>[}\])])"""
+    r"""|(?P<ident>[A-Za-z_][\w-]*)"""
+    r"""|(?P<equal>=(?![=>]))"""
+    r"""|(?P<newline>\n)""",
+    re.DOTALL,
+)
+# runs of text without nesting, strings with templates, comments nor heredocs
+_BLOCK_TEXT = re.compile(r'(?:[^"{}\[\]()#/<]+|"[^"\\$%\n]*"|/(?![/*])|<(?!<))*')
+_HEREDOC = re.compile(r"<<-?[ \t]*(?P<marker>[A-Za-z_][\w-]*)[ \t]*\r?\n")
+_STRING_CHUNK = re.compile(r'[^"\\$%\n]*')
+_TEMPLATE_TOKENS = re.compile(r'["{}]')
+# what may follow a literal source on its line
+_LITERAL_END = re.compile(r"[ \t]*(?:#|//|\r?\n|}|$)")
+
+
+def _heredoc_end(text: str, pos: int, marker: str) -> int:
+    """Helper function to find the end of a heredoc starting after its first line.
+
+    Returns:
+        The position after the closing marker, or -1 if the heredoc is unterminated.
+    """
+    end = re.compile(
+        r"^[ \t]*" + re.escape(marker) + r"[ \t]*\r?$", re.MULTILINE
+    ).search(text, pos)
+    return -1 if end is None else end.end()
+
+
+def _string_end(text: str, pos: int) -> Tuple[int, bool]:
+    """Helper function to find the end of a quoted string starting after its opening
+    quote.
+
+    Returns:
+        The position after the closing quote, or -1 if the string is unterminated, and
+        wether the string is a plain literal, without escapes nor templates.
+    """
+    literal = True
+    while True:
+        pos = _STRING_CHUNK.match(text, pos).end()
+        if pos >= len(text) or text[pos] == "\n":
+            return -1, False
+        c = text[pos]
+        if c == '"':
+            return pos + 1, literal
+        if c == "\\":
+            literal = False
+            pos += 2
+        elif text.startswith("{", pos + 1):
+            # `${...}` interpolation or `%{...}` directive, which may nest strings
+            literal = False
+            depth = 1
+            pos += 2
+            while depth:
+                m = _TEMPLATE_TOKENS.search(text, pos)
+                if m is None:
+                    return -1, False
+                pos = m.end()
+                if m.group() == '"':
+                    pos, _ = _string_end(text, pos)
+                    if pos < 0:
+                        return -1, False
+                else:
+                    depth += 1 if m.group() == "{" else -1
+        else:
+            pos += 1
+
+
+def _block_end(text: str, pos: int) -> int:
+    """Helper function to skip a block or a bracketed expression starting after its
+    opening bracket.
+
+    Returns:
+        The position after the closing bracket, or -1 if it is unterminated.
+    """
+    depth = 1
+    while True:
+        pos = _BLOCK_TEXT.match(text, pos).end()
+        if pos >= len(text):
+            return -1
+        c = text[pos]
+        if c in "{[(":
+            depth += 1
+            pos += 1
+        elif c in "}])":
+            depth -= 1
+            pos += 1
+            if not depth:
+                return pos
+        elif c == '"':
+            pos, _ = _string_end(text, pos + 1)
+        elif c == "#" or text.startswith("//", pos):
+            pos = text.find("\n", pos)
+        elif text.startswith("/*", pos):
+            pos = text.find("*/", pos + 2)
+            pos = pos if pos < 0 else pos + 2
+        else:
+            m = _HEREDOC.match(text, pos)
+            pos = _heredoc_end(text, m.end(), m.group("marker")) if m else pos + 1
+        if pos < 0:
+            return -1
+
+
+def scan_module_sources(text: str) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """Function to extract the module calls of a terraform file without parsing it.
+
+    The file is only tokenized as far as needed to find the `module` blocks: comments,
+    strings, templates, heredocs and the other blocks are skipped, and the `source`
+    attribute is read when it is a plain string literal.
+
+    Args:
+        text: The content of the terraform file.
+
+    Returns:
+        The `(module_name, source)` pairs, in order of appearance, with a None source
+        for modules without one. None if a source isn't a plain string literal or the
+        file can't be tokenized, in which case the file has to be parsed.
+    """
+    res: List[Tuple[str, Optional[str]]] = []
+    # tokens of the current line, at the top level (block headers) or in a module body
+    line: List[str] = []
+    # name of the module whose body is being scanned
+    module: Optional[str] = None
+    source: Optional[str] = None
+    pos = 0
+    while True:
+        m = _TOKENS.search(text, pos)
+        if m is None:
+            break
+        pos = m.end()
+        kind = m.lastgroup
+        # wether the token is the value of the module's `source` attribute
+        is_source = module is not None and line == ["source", "="]
+        if kind == "comment":
+            continue
+        elif kind == "newline":
+            line.clear()
+        elif kind == "heredoc":
+            pos = _heredoc_end(text, pos, m.group("marker"))
+            if pos < 0 or is_source:
+                return None
+            line.append("<<")
+        elif kind in ("literal", "string"):
+            start = m.start() + 1
+            literal = kind == "literal"
+            if not literal:
+                pos, literal = _string_end(text, pos)
+                if pos < 0:
+                    return None
+            if is_source:
+                # anything after the string makes it an expression, e.g. a conditional
+                if not literal or source is not None or not _LITERAL_END.match(text, pos):
+                    return None
+                source = text[start:pos - 1]
+            line.append(text[start - 1:pos] if literal else '"${}"')
+        elif kind == "open":
+            if is_source:
+                return None
+            if module is None and m.group() == "{" and len(line) == 2 and line[0] == "module":
+                if line[1] == '"${}"':
+                    return None
+                module = line[1].strip('"')
+                source = None
+            else:
+                # the other blocks and the expressions in module bodies are skipped
+                pos = _block_end(text, pos)
+                if pos < 0:
+                    return None
+            line.clear()
+        elif kind == "close":
+            if is_source or module is None:
+                return None
+            res.append((module, source))
+            module = None
+            line.clear()
+        elif is_source:
+            # e.g. a variable or a function call
+            return None
+        else:
+            line.append(m.group())
+    if module is not None:
+        return None
+    return res
+
+
+def module_sources(file: str) -> List[str]:
+    """Function to get the sources of all the modules called in a terraform file.
+
+    The file is scanned with `scan_module_sources`, and only parsed with hcl2 when a
+    source isn't a plain string literal.
+
+    Args:
+        file: The path of the terraform file.
+
+    Returns:
+        The `source` attributes of the `module` blocks, in order of appearance.
+    """
+    with open(file, "r") as fp:
+        text = fp.read()
+    pairs = scan_module_sources(text)
+    if pairs is not None:
+        return [source for _, source in pairs]
+
+    # imported on first use, as the lark grammar is slow to load
+    import hcl2
+
+    obj = hcl2.loads(text)
+    # each module is a dictionnary with one key/value pair, where
+    # - the key is the module name
+    # - the values contain the module configuration
+    return [list(module.values())[0].get("source") for module in obj.get("module", [])]
+
+
+def module_sources_batch(files: List[str]) -> List[List[str]]:
+    """Function to get the module sources of several terraform files, e.g. in a worker
+    process.
+
+    Args:
+        files: The paths of the terraform files.
+
+    Returns:
+        The module sources of each file, in the same order as `files`.
+    """
+    return [module_sources(file) for file in files]
+
+
+class ModuleSourceCache:
+    """Persistent cache of the module sources extracted from terraform files.
+
+    Entries are keyed by file path and hold the git blob hash of the parsed content,
+    so that a file is parsed again only when its content changes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file: str):
+        """
+        Args:
+            file: The path of the JSON cache file.
+        """
+        self.file = file
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = False
+        try:
+            with open(file, "r") as fp:
+                data = json.load(fp)
+            if data.get("version") == self.VERSION:
+                self._entries = data.get("files", {})
+        except (OSError, ValueError):
+            # missing or corrupted cache, start from scratch
+            pass
+
+    def get(self, path: str, blob: Optional[str]) -> Optional[List[str]]:
+        """Function to get the cached module sources of a file.
+
+        Args:
+            path: The path of the file, relative to the repo root.
+            blob: The git blob hash of the file content.
+
+        Returns:
+            The module sources, or None on a cache miss.
+        """
+        entry = self._entries.get(path)
+        if blob is not None and entry is not None and entry.get("blob") == blob:
+            self.hits += 1
+            return entry["sources"]
+        if entry is not None:
+            # stale entry
+            del self._entries[path]
+            self._dirty = True
+        self.misses += 1
+        return None
+
+    def put(self, path: str, blob: Optional[str], sources: List[str]) -> None:
+        """Function to store the module sources of a file.
+
+        Args:
+            path: The path of the file, relative to the repo root.
+            blob: The git blob hash of the file content.
+            sources: The module sources of the file.
+        """
+        if blob is None:
+            return
+        self._entries[path] = {"blob": blob, "sources": sources}
+        self._dirty = True
+
+    def prune(self, index: GitIndex) -> None:
+        """Function to evict the entries of files that are no longer tracked.
+
+        Args:
+            index: The index of the files tracked by git.
+        """
+        for path in [p for p in self._entries if p not in index]:
+            del self._entries[path]
+            self._dirty = True
+
+    def save(self) -> None:
+        """Function to write the cache file, atomically and only if it changed."""
+        if not self._dirty:
+            return
+        dir = os.path.dirname(os.path.abspath(self.file))
+        os.makedirs(dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dir, prefix=".hcl-", suffix=".json")
+        with os.fdopen(fd, "w") as fp:
+            json.dump({"version": self.VERSION, "files": self._entries}, fp)
+        os.replace(tmp, self.file)
+        self._dirty = False
+
+
+class ModuleGraph:
+    """Per-run cache of the terraform module dependency graph.
+
+    Modules are keyed by their directory normalized relative to the repo root, so
+    that a module shared by several projects is globbed and parsed only once.
+    Modules are resolved one dependency level at a time: the terraform files of a
+    level are gathered first and then parsed, in parallel if `jobs` is above 1.
+    """
+
+    def __init__(
+        self, index: GitIndex, cache: Optional[ModuleSourceCache] = None, jobs: int = 1
+    ):
+        """
+        Args:
+            index: The index of the files tracked by git.
+            cache: The persistent cache of the module sources. Disabled if not given.
+            jobs: The number of processes parsing terraform files.
+        """
+        self.index = index
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._nodes: Dict[str, ModuleNode] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def close(self) -> None:
+        """Function to shut down the parsing processes, if any."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _ls_files(self, pattern: str) -> List[str]:
+        return self.index.ls_files([pattern], cwd=self.index.root)
+
+    def _parse(self, files: List[str]) -> Dict[str, List[str]]:
+        """Helper function to get the module sources of terraform files, from the cache
+        or by parsing the files.
+        """
+        res: Dict[str, List[str]] = {}
+        blobs: Dict[str, Optional[str]] = {}
+        misses: List[str] = []
+        for file in files:
+            if file in res or file in blobs:
+                continue
+            if self.cache is not None:
+                blobs[file] = self.index.blob_hash(file)
+                sources = self.cache.get(file, blobs[file])
+                if sources is not None:
+                    res[file] = sources
+                    continue
+            misses.append(file)
+
+        paths = [os.path.join(self.index.root, file) for file in misses]
+        with span("hcl.parse", files=len(paths), cached=len(res), jobs=self.jobs):
+            if self.jobs > 1 and len(paths) > 1:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.jobs)
+                # a few batches per process to balance uneven file sizes
+                size = -(-len(paths) // (self.jobs * 4))
+                batches = [paths[i:i + size] for i in range(0, len(paths), size)]
+                parsed = [
+                    sources
+                    for batch in self._executor.map(module_sources_batch, batches)
+                    for sources in batch
+                ]
+            else:
+                parsed = module_sources_batch(paths)
+
+        for file, sources in zip(misses, parsed):
+            res[file] = sources
+            if self.cache is not None:
+                self.cache.put(file, blobs[file], sources)
+        return res
+
+    def resolve(self, dirs: List[str]) -> None:
+        """Function to resolve modules and all the modules they transitively source.
+
+        Args:
+            dirs: The module directories, relative to the repo root.
+        """
+        frontier = {posixpath.normpath(dir) for dir in dirs} - self._nodes.keys()
+        if not frontier:
+            return
+        with span("modules.resolve", dirs=len(frontier)):
+            self._resolve(frontier)
+
+    def _resolve(self, frontier: Set[str]) -> None:
+        while frontier:
+            level = {}
+            for dir in sorted(frontier):
+                globs: List[tuple] = []
+                tf_files: List[str] = []
+                for type, suffix in MODULE_FILE_TYPES:
+                    files = self._ls_files(dir + suffix + type)
+                    if type == "tf":
+                        if not files:
+                            # not a terraform module
+                            break
+                        tf_files = files
+                    if files:
+                        globs.append((type, suffix + type))
+                level[dir] = (globs, tf_files)
+
+            sources = self._parse([file for _, tf_files in level.values() for file in tf_files])
+
+            frontier = set()
+            for dir, (globs, tf_files) in level.items():
+                children: Dict[str, None] = {}
+                for file in tf_files:
+                    for source in sources[file]:
+                        # remote modules have no files in the repo
+                        if source_type(source) != "local":
+                            continue
+                        # sources are relative to the directory of the file calling the module
+                        child = normalize_module_path(posixpath.dirname(file), source)
+                        if child != ".." and not child.startswith("../"):
+                            children[child] = None
+                self._nodes[dir] = ModuleNode(dir, globs, tf_files, list(children))
+                frontier.update(child for child in children if child not in self._nodes)
+
+    def invalidate(self, files: Iterable[str], index: Optional[GitIndex] = None) -> None:
+        """Function to forget the modules containing changed files, so that they are
+        resolved again on next access while the rest of the graph is kept.
+
+        Args:
+            files: The changed files, relative to the repo root.
+            index: The new index of the files tracked by git, if it changed.
+        """
+        if index is not None:
+            self.index = index
+        for file in files:
+            # the globs of a module also cover the files of its subdirectories
+            dir = posixpath.dirname(posixpath.normpath(file))
+            while True:
+                self._nodes.pop(dir or ".", None)
+                if not dir:
+                    break
+                dir = posixpath.dirname(dir)
+
+    def node(self, dir: str) -> ModuleNode:
+        """Function to get a module of the graph, resolving it on first access.
+
+        Args:
+            dir: The module directory, relative to the repo root.
+
+        Returns:
+            The resolved module.
+        """
+        dir = posixpath.normpath(dir)
+        if dir not in self._nodes:
+            self.resolve([dir])
+        return self._nodes[dir]
+
+    def closure(self, project_dir: str) -> ModuleClosure:
+        """Function to get the modules a project transitively depends on.
+
+        The traversal visits each module once, so diamond dependencies and cycles are
+        handled in linear time. It only reads the graph once the project is resolved,
+        so it can be called from several threads after `resolve`.
+
+        Args:
+            project_dir: The project directory, relative to the repo root.
+
+        Returns:
+            The closure of the project.
+        """
+        project_dir = posixpath.normpath(project_dir)
+        if project_dir not in self._nodes:
+            self.resolve([project_dir])
+
+        dirs = [project_dir]
+        cycles: List[List[str]] = []
+        # modules on the current dependency path, to detect cycles
+        path = [project_dir]
+        on_path: Set[str] = {project_dir}
+        visited: Set[str] = {project_dir}
+        stack = deque([iter(self._nodes[project_dir].children)])
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                on_path.discard(path.pop())
+            elif child in on_path:
+                cycles.append(path[path.index(child):] + [child])
+            elif child not in visited:
+                visited.add(child)
+                dirs.append(child)
+                path.append(child)
+                on_path.add(child)
+                # modules forgotten by `invalidate` are resolved again
+                stack.append(iter(self.node(child).children))
+        return ModuleClosure(dirs, cycles)
+
+    def when_modified(self, project_dir: str, closure: Optional[ModuleClosure] = None) -> List[str]:
+        """Function to get the dependency paths of a project, i.e. the file-type globs
+        of the project and all the modules it transitively sources.
+
+        Args:
+            project_dir: The project directory, relative to the repo root.
+            closure: The closure of the project. Computed if not given.
+
+        Returns:
+            The sorted globs, relative to the project directory.
+        """
+        project_dir = posixpath.normpath(project_dir)
+        if closure is None:
+            closure = self.closure(project_dir)
+        res = set()
+        for dir in closure.dirs:
+            rel = relative_module_path(dir, project_dir)
+            res.update(rel + glob for _, glob in self._nodes[dir].globs)
+        return sorted(res)
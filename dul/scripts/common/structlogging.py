@@ -1,22 +1,123 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
 import logging
+import os
+import sys
+import threading
+import time
 
-import structlog
-
-structlog.configure(
-    processors=[
-        # structlog.stdlib.filter_by_level,
-        # structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        # structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.UnicodeDecoder(),
-        structlog.dev.ConsoleRenderer(sort_keys=False),
-        # structlog.stdlib.render_to_log_kwargs,
-        # structlog.processors.JSONRenderer()
-    ],
-    logger_factory=structlog.PrintLoggerFactory(),
-    wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-    cache_logger_on_first_use=True
-)
+# DUL_TRACE enables spans: `console` and `json` log them, `chrome[:<file>]` writes them
+# to a Chrome trace-event file (trace.json by default) when the process exits
+trace_format, _, trace_file = os.environ.get("DUL_TRACE", "").partition(":")
+
+
+def configure():
+    """Function to configure structlog for dul's scripts and pipelines.
+
+    Nothing is done if structlog is already configured, so that applications using dul
+    as a library keep their own configuration.
+    """
+    # structlog is imported on first use, as it loads rich when it is installed
+    import structlog
+
+    if structlog.is_configured():
+        return
+    structlog.configure(
+        processors=[
+            structlog.contextvars.merge_contextvars,
+            # structlog.stdlib.filter_by_level,
+            # structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+        ] + ([
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.JSONRenderer(),
+        ] if trace_format == "json" else [
+            structlog.dev.ConsoleRenderer(sort_keys=False),
+            # structlog.stdlib.render_to_log_kwargs,
+        ]),
+        logger_factory=structlog.PrintLoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+        cache_logger_on_first_use=True
+    )
+
+
+# spans active in the current context, innermost last
+_active_spans: contextvars.ContextVar[tuple] = contextvars.ContextVar("dul_spans", default=())
+_trace_events: list[dict] = []
+_trace_start = time.perf_counter()
+
+
+def _write_trace():
+    with open(trace_file or "trace.json", "w") as fp:
+        json.dump({"traceEvents": _trace_events, "displayTimeUnit": "ms"}, fp)
+
+
+def count_subprocess(n: int = 1):
+    """Function to record subprocesses started in all the active spans."""
+    for s in _active_spans.get():
+        s.subprocesses += n
+
+
+class span:
+    """Context manager and decorator recording the wall time and the number of
+    subprocesses of a block of code, when tracing is enabled with `DUL_TRACE`."""
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.subprocesses = 0
+
+    def __enter__(self) -> "span":
+        if trace_format:
+            self._token = _active_spans.set(_active_spans.get() + (self,))
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not trace_format:
+            return
+        duration = time.perf_counter() - self._start
+        _active_spans.reset(self._token)
+        if trace_format == "chrome":
+            # one track per asyncio task, asyncio can't be running if it isn't imported
+            asyncio = sys.modules.get("asyncio")
+            try:
+                tid = id(asyncio.current_task()) if asyncio else threading.get_ident()
+            except RuntimeError:
+                tid = threading.get_ident()
+            if not _trace_events:
+                atexit.register(_write_trace)
+            _trace_events.append({
+                "name": self.name, "ph": "X", "pid": os.getpid(), "tid": tid,
+                "ts": (self._start - _trace_start) * 1e6, "dur": duration * 1e6,
+                "args": {**self.attrs, "subprocesses": self.subprocesses},
+            })
+        else:
+            import structlog
+
+            structlog.get_logger().info(
+                "span", span=self.name, duration=round(duration, 6),
+                subprocesses=self.subprocesses, **self.attrs
+            )
+
+    def __call__(self, func):
+        # a fresh span per call, so that the decorated function can run concurrently
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(self.name, **self.attrs):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.attrs):
+                return func(*args, **kwargs)
+        return wrapper
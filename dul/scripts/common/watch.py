@@ -0,0 +1,142 @@
+"""
+File watching helper functions in python
+"""
+
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, Set, Tuple
+
+from . import filesystem
+
+
+def _relative(paths: Iterable[str], root: str) -> Set[str]:
+    return {os.path.relpath(p, root).replace(os.sep, "/") for p in paths}
+
+
+def _inotify_batches(
+    inotify, flags, root: str, debounce: float, excluded: Callable[[str], bool]
+) -> Iterator[Set[str]]:
+    """Helper function to watch a directory tree with inotify, one watch per directory."""
+    mask = (
+        flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+    )
+    dirs: Dict[int, str] = {}
+
+    def add(dir: str) -> Set[str]:
+        # watches a new directory tree and returns the files already in it
+        files = set()
+        stack = [dir]
+        while stack:
+            dir = stack.pop()
+            try:
+                dirs[inotify.add_watch(dir, mask)] = dir
+                entries = os.scandir(dir)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        files.add(entry.path)
+                    elif not excluded(entry.name):
+                        stack.append(entry.path)
+        return files
+
+    add(root)
+    while True:
+        events = inotify.read()
+        # a batch ends once no event came for `debounce` seconds
+        while True:
+            more = inotify.read(timeout=int(debounce * 1000))
+            if not more:
+                break
+            events += more
+
+        changed = set()
+        for event in events:
+            if event.mask & flags.IGNORED:
+                dirs.pop(event.wd, None)
+                continue
+            dir = dirs.get(event.wd)
+            if dir is None or not event.name:
+                continue
+            path = os.path.join(dir, event.name)
+            if not event.mask & flags.ISDIR:
+                changed.add(path)
+            elif event.mask & (flags.CREATE | flags.MOVED_TO) and not excluded(event.name):
+                changed |= add(path)
+        if changed:
+            yield _relative(changed, root)
+
+
+def _snapshot(root: str, excludes: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    res = {}
+    for file in filesystem.walk_files(root, "*", excludes=excludes):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+        res[file] = (stat.st_mtime_ns, stat.st_size)
+    return res
+
+
+def _diff(old: Dict[str, Tuple[int, int]], new: Dict[str, Tuple[int, int]]) -> Set[str]:
+    return {file for file in old.keys() | new.keys() if old.get(file) != new.get(file)}
+
+
+def _poll_batches(
+    root: str, debounce: float, interval: float, excludes: Iterable[str]
+) -> Iterator[Set[str]]:
+    """Helper function to watch a directory tree by comparing the file stats."""
+    snapshot = _snapshot(root, excludes)
+    while True:
+        time.sleep(interval)
+        new = _snapshot(root, excludes)
+        changed = _diff(snapshot, new)
+        snapshot = new
+        # a batch ends once nothing changed for `debounce` seconds
+        while changed:
+            time.sleep(debounce)
+            new = _snapshot(root, excludes)
+            more = _diff(snapshot, new)
+            snapshot = new
+            if not more:
+                break
+            changed |= more
+        if changed:
+            yield _relative(changed, root)
+
+
+def watch_files(
+    root: str, debounce: float = 0.05, interval: float = 0.5,
+    excludes: Iterable[str] = filesystem.DEFAULT_EXCLUDES, polling: bool = False,
+) -> Iterator[Set[str]]:
+    """Function to watch a directory tree for file changes.
+
+    inotify is used when the optional `inotify_simple` package is installed and
+    supported by the OS, polling otherwise.
+
+    Args:
+        root: The directory to watch.
+        debounce: The quiet period, in seconds, ending a batch of changes.
+        interval: The polling interval, in seconds.
+        excludes: Shell-style patterns of directory names not to watch.
+        polling: Wether to poll even if inotify is available.
+
+    Returns:
+        An iterator over batches of created, modified and deleted files, relative to
+        `root`. It blocks until the next batch.
+    """
+    excludes = list(excludes)
+    if not polling:
+        try:
+            from inotify_simple import INotify, flags
+
+            inotify = INotify()
+        except (ImportError, OSError, AttributeError):
+            pass
+        else:
+            return _inotify_batches(
+                inotify, flags, root, debounce, filesystem.compile_patterns(excludes)
+            )
+    return _poll_batches(root, debounce, interval, excludes)
+
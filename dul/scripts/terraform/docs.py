@@ -1,67 +1,263 @@
 import argparse
+import difflib
+import glob
+import hashlib
+import json
 import os
-import subprocess
+import tempfile
+from typing import Optional
 
 import anyio
+import anyio.lowlevel
 import structlog
-from dul.scripts.common.structlogging import *
+from dul.scripts.common.structlogging import configure, count_subprocess, span
 from dul.scripts.common import filesystem
 
-parser = argparse.ArgumentParser()
-parser.add_argument("dir", nargs='?', default=os.getcwd())
-parser.add_argument("-l", "--local", action='store_true')
-args = parser.parse_args()
-
 log = structlog.get_logger()
 
 readme_name = "README.md"
+command = "terraform-docs markdown table"
+inject_options = ["--output-file", readme_name, "--output-mode", "inject"]
+begin_marker = "<!-- BEGIN_TF_DOCS -->"
+end_marker = "<!-- END_TF_DOCS -->"
+# terraform-docs' default output template, whose first and last lines are the markers
+content_placeholder = "{{ .Content }}"
+default_template = f"{begin_marker}\n{content_placeholder}\n{end_marker}"
+# terraform-docs configuration files, relative to the module, in lookup order
+config_names = [".terraform-docs.yml", os.path.join(".config", ".terraform-docs.yml")]
+# files terraform-docs reads in a module: the terraform ones, the lock file for the
+# provider versions, and its configuration files
+input_patterns = ["*.tf", "*.tf.json"]
+input_names = [".terraform.lock.hcl"] + config_names
 
 
-async def docs(path: str, local: bool):
-    command = f"terraform-docs markdown table --output-file {readme_name} --output-mode inject"
+def hint(path: str) -> str:
+    return " ".join(command.split() + inject_options + [path])
 
-    def generate_readme():
-        process = subprocess.Popen(
-            command.split() + [path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        output, error = process.communicate()
-        if output != b"":
-            log.info(output, path=path)
-        if error != b"":
-            log.error(error, path=path)
-            raise SystemExit(1)
-
-    if local:
-        generate_readme()
-    else:
+
+def hash_file(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def hash_inputs(path: str, version: str) -> str:
+    # the README only depends on the module's terraform files, its lock file, the
+    # terraform-docs version and its configuration
+    digest = hashlib.sha256(version.encode())
+    files = sorted(
+        file for pattern in input_patterns
+        for file in glob.glob(os.path.join(glob.escape(path), pattern))
+    )
+    files += [os.path.join(path, name) for name in input_names]
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode() + b"\0")
+        digest.update((hash_file(file) or "").encode() + b"\0")
+    return digest.hexdigest()
+
+
+def load_manifest(file: str) -> dict:
+    try:
+        with open(file, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(file: str, manifest: dict):
+    dir = os.path.dirname(os.path.abspath(file))
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix=".terraform-docs-", suffix=".json")
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.replace(tmp, file)
+
+
+class DocsError(Exception):
+    pass
+
+
+async def terraform_docs(path: str, *options: str) -> str:
+    with span("terraform-docs", path=path):
+        count_subprocess()
+        process = await anyio.run_process(command.split() + list(options) + [path], check=False)
+    if process.stderr != b"" or process.returncode != 0:
+        raise DocsError(process.stderr.decode().strip() or f"exit code {process.returncode}")
+    return process.stdout.decode()
+
+
+def output_template(path: str) -> str:
+    # the output template of the module's terraform-docs configuration, which sets the
+    # markers of the generated section
+    for name in config_names:
+        file = os.path.join(path, name)
+        if not os.path.isfile(file):
+            continue
+        # imported here rather than at the top, so that the command starts fast
+        from ruamel.yaml import YAML
+        from ruamel.yaml.error import YAMLError
+
+        try:
+            with open(file, 'r') as fp:
+                config = YAML(typ="safe").load(fp)
+        except YAMLError as exc:
+            raise DocsError(f"invalid configuration {file}: {exc}")
+        output = config.get("output") if isinstance(config, dict) else None
+        return (output or {}).get("template") or default_template
+    return default_template
+
+
+def inject(readme: str, content: str, template: str = default_template) -> str:
+    # mirrors terraform-docs' inject output mode: the content is rendered in the output
+    # template, whose first and last lines are the begin and end comments
+    lines = template.split("\n")
+    begin, end = lines[0].strip(), lines[-1].strip()
+    if content_placeholder not in template:
+        raise DocsError(f"output template doesn't have '{content_placeholder}'")
+    if len(lines) < 2 or not begin or not end:
+        raise DocsError("output template must start and end with a comment")
+    generated = template.replace(content_placeholder, content.rstrip())
+    if readme == "":
+        return generated
+    before = readme.find(begin)
+    after = readme.find(end)
+    if before < 0 and after < 0:
+        return readme + "\n" + generated
+    if before < 0:
+        raise DocsError("begin comment is missing")
+    if after < 0:
+        raise DocsError("end comment is missing")
+    if after < before:
+        raise DocsError("end comment is before begin comment")
+    return readme[:before] + generated + readme[after + len(end):]
+
+
+async def generate(path: str):
+    output = await terraform_docs(path, *inject_options)
+    if output.strip():
+        log.info(output.strip(), path=path)
+
+
+async def check(path: str) -> Optional[str]:
+    # the generated section is rendered on stdout and injected in memory, so that
+    # checking never writes to the working tree
+    readme = os.path.join(path, readme_name)
+    if not os.path.exists(readme):
+        raise DocsError(f"File {readme} doesn't exist")
+    with open(readme, 'r') as file:
+        current_readme = file.read()
+    template = output_template(path)
+    # an output file set in the configuration is overridden, so that the content is
+    # printed rather than written
+    new_readme = inject(current_readme, await terraform_docs(path, "--output-file", ""), template)
+    if current_readme == new_readme:
+        return None
+    return "".join(difflib.unified_diff(
+        current_readme.splitlines(keepends=True),
+        new_readme.splitlines(keepends=True),
+        fromfile=readme,
+        tofile=f"{readme} (generated)",
+    ))
+
+
+async def main(args: argparse.Namespace):
+    # bounds the number of terraform-docs processes running at once
+    limiter = anyio.CapacityLimiter(max(1, args.jobs))
+    failures: list[str] = []
+    outdated: dict[str, str] = {}
+
+    # the manifest is only used when given, so that nothing is written to the working
+    # tree by default
+    use_cache = bool(args.cache_file) and not args.no_cache
+    manifest: dict = {}
+    version = ""
+    if use_cache:
+        count_subprocess()
+        process = await anyio.run_process(["terraform-docs", "--version"], check=False)
+        version = process.stdout.decode().strip()
+        manifest = load_manifest(args.cache_file)
+        if manifest.get("version") != version:
+            manifest = {"version": version, "modules": {}}
+    modules: dict = manifest.get("modules", {})
+    skipped = 0
+
+    async def run(path: str):
+        nonlocal skipped
+        key = os.path.relpath(path, args.dir)
         readme = os.path.join(path, readme_name)
-        if not os.path.exists(readme):
-            log.error(
-                f"File {readme} doesn't exist",
-                hint=f"Try running {command} {path}"
-            )
-            raise SystemExit(1)
-        else:
-            with open(readme, 'r') as file:
-                current_readme = file.read()
-            generate_readme()
-            with open(readme, 'r') as file:
-                new_readme = file.read()
-
-            if current_readme != new_readme:
-                log.error(
-                    f"File {readme} doesn't seem to be up-to-date.",
-                    hint=f"Try running {command} {path}"
-                )
-                raise SystemExit(1)
-
-
-async def main():
+        if use_cache:
+            inputs = hash_inputs(path, version)
+            entry = modules.get(key)
+            if entry == {"inputs": inputs, "readme": hash_file(readme)}:
+                skipped += 1
+                return
+        async with limiter:
+            # failures are collected rather than raised, so that they don't cancel
+            # the other modules in the middle of writing their README
+            try:
+                if args.local:
+                    await generate(path)
+                else:
+                    diff = await check(path)
+                    if diff is not None:
+                        outdated[path] = diff
+            except DocsError as exc:
+                log.error(str(exc), path=path, hint=f"Try running {hint(path)}")
+                failures.append(path)
+            if path in outdated or path in failures:
+                modules.pop(key, None)
+                return
+        if use_cache:
+            modules[key] = {"inputs": inputs, "readme": hash_file(readme)}
+
     async with anyio.create_task_group() as tg:
-        for path in filesystem.find_files(args.dir, "main.tf"):
-            tg.start_soon(docs, os.path.dirname(path), args.local)
+        for path in filesystem.walk_files(args.dir, "main.tf"):
+            tg.start_soon(run, os.path.dirname(path))
+            # let the module start while the rest of the tree is walked
+            await anyio.lowlevel.checkpoint()
+
+    if use_cache:
+        save_manifest(args.cache_file, manifest)
+        log.info("terraform-docs cache", skipped=skipped, cache=args.cache_file)
+
+    for path in sorted(outdated):
+        print(outdated[path])
+    if outdated:
+        log.error(
+            "READMEs don't seem to be up-to-date",
+            modules=sorted(outdated),
+            hint="Try running this script with --local",
+        )
+    if failures:
+        log.error("terraform-docs failed", modules=sorted(failures))
+    if outdated or failures:
+        raise SystemExit(1)
+
+
+def cli(argv: Optional[list[str]] = None):
+    """Entry point of the `dul-terraform-docs` command."""
+    parser = argparse.ArgumentParser(prog="dul-terraform-docs")
+    parser.add_argument("dir", nargs='?', default=os.getcwd())
+    parser.add_argument("-l", "--local", action='store_true')
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="Maximum number of concurrent terraform-docs processes. CPU count if not set"
+    )
+    parser.add_argument(
+        "--cache-file", default=None,
+        help="Cache manifest file. No manifest is used if not set"
+    )
+    parser.add_argument(
+        "--no-cache", action='store_true',
+        help="Run terraform-docs on every module, ignoring the cache manifest"
+    )
+    args = parser.parse_args(argv)
+
+    configure()
+    anyio.run(main, args)
+
 
 if __name__ == "__main__":
-    anyio.run(main)
+    cli()
@@ -0,0 +1,303 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from collections import deque
+from typing import Optional
+
+import anyio
+import anyio.lowlevel
+import structlog
+from dul.scripts.common.structlogging import configure, count_subprocess, span
+from dul.scripts.common import filesystem
+from dul.scripts.common.modules import module_sources, normalize_module_path, source_type
+
+severities = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
+
+log = structlog.get_logger()
+
+command = "tfsec --format json --soft-fail --no-color"
+# files tfsec reads in a root or module, and its configuration directory
+input_names = ["*.tf", "*.tf.json"]
+config_dir = ".tfsec"
+
+
+class TfsecError(Exception):
+    pass
+
+
+async def tfsec(path: str) -> list[dict]:
+    with span("tfsec", path=path):
+        count_subprocess()
+        process = await anyio.run_process(command.split() + [path], check=False)
+    if process.returncode != 0:
+        raise TfsecError(process.stderr.decode().strip() or f"exit code {process.returncode}")
+    try:
+        report = json.loads(process.stdout)
+    except ValueError as exc:
+        raise TfsecError(f"invalid tfsec output: {exc}")
+    return report.get("results") or []
+
+
+def hash_file(path: str) -> str:
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return ""
+
+
+def root_digest(path: str, version: str, sources: dict[str, list], used: dict[str, list]) -> str:
+    # a root's findings depend on its terraform files, the ones of the local modules it
+    # transitively sources, the tfsec configuration and the tfsec version
+    files: dict[str, str] = {}
+    queue = deque([os.path.normpath(path)])
+    seen = set(queue)
+    while queue:
+        dir = queue.popleft()
+        for file in filesystem.walk_files(dir, *input_names):
+            if file in files:
+                continue
+            digest = files[file] = hash_file(file)
+            if not file.endswith(".tf"):
+                continue
+            if digest not in sources:
+                try:
+                    sources[digest] = module_sources(file)
+                except Exception:
+                    # tfsec reports the parse error itself
+                    sources[digest] = []
+            used[digest] = sources[digest]
+            for source in sources[digest]:
+                if source_type(source) != "local":
+                    continue
+                module = normalize_module_path(os.path.dirname(file), source)
+                if module not in seen:
+                    seen.add(module)
+                    queue.append(module)
+    for file in filesystem.walk_files(os.path.join(path, config_dir), "*", excludes=[]):
+        files[file] = hash_file(file)
+
+    digest = hashlib.sha256(version.encode() + b"\0")
+    for file in sorted(files):
+        digest.update(os.path.relpath(file, path).encode() + b"\0" + files[file].encode() + b"\0")
+    return digest.hexdigest()
+
+
+def relocate(findings: list[dict], src: str, dst: str) -> list[dict]:
+    # cached findings are stored with paths relative to the scanned directory, so that
+    # they can be replayed wherever the code is mounted. Fresh findings are relocated
+    # onto the scanned directory too, so that they are keyed like the replayed ones
+    res = []
+    for finding in findings:
+        location = dict(finding.get("location") or {})
+        filename = location.get("filename")
+        if filename:
+            location["filename"] = os.path.normpath(
+                os.path.join(dst, os.path.relpath(os.path.abspath(filename), os.path.abspath(src)))
+            )
+        res.append({**finding, "location": location})
+    return res
+
+
+def load_cache(file: str) -> dict:
+    try:
+        with open(file, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def finding_key(finding: dict) -> tuple:
+    # nested roots are scanned by their parents too
+    location = finding.get("location") or {}
+    return (
+        finding.get("long_id") or finding.get("rule_id"),
+        location.get("filename"),
+        location.get("start_line"),
+        location.get("end_line"),
+    )
+
+
+def severity_rank(finding: dict) -> int:
+    severity = str(finding.get("severity", "")).upper()
+    return severities.index(severity) if severity in severities else len(severities)
+
+
+def sarif(findings: list[dict]) -> dict:
+    levels = {"CRITICAL": "error", "HIGH": "error", "MEDIUM": "warning", "LOW": "note"}
+    rules: dict[str, dict] = {}
+    results = []
+    for finding in findings:
+        rule_id = finding.get("long_id") or finding.get("rule_id")
+        rules.setdefault(rule_id, {
+            "id": rule_id,
+            "shortDescription": {"text": finding.get("rule_description", "")},
+            "helpUri": (finding.get("links") or [""])[0],
+        })
+        location = finding.get("location") or {}
+        results.append({
+            "ruleId": rule_id,
+            "level": levels.get(str(finding.get("severity", "")).upper(), "warning"),
+            "message": {"text": finding.get("description", "")},
+            "locations": [{"physicalLocation": {
+                "artifactLocation": {"uri": location.get("filename", "")},
+                "region": {
+                    "startLine": location.get("start_line", 1),
+                    "endLine": location.get("end_line", location.get("start_line", 1)),
+                },
+            }}],
+        })
+    return {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {"name": "tfsec", "rules": list(rules.values())}},
+            "results": results,
+        }],
+    }
+
+
+def write_json(file: str, data: dict):
+    dir = os.path.dirname(os.path.abspath(file))
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dir, suffix=".json")
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(tmp, file)
+
+
+def summary(findings: list[dict], threshold: str) -> int:
+    failing = 0
+    for finding in sorted(findings, key=lambda f: -severity_rank(f)):
+        location = finding.get("location") or {}
+        severity = str(finding.get("severity", "")).upper()
+        failed = severity_rank(finding) >= severities.index(threshold)
+        failing += failed
+        (log.error if failed else log.warning)(
+            finding.get("description", ""),
+            rule=finding.get("long_id") or finding.get("rule_id"),
+            severity=severity,
+            location=f"{location.get('filename')}:{location.get('start_line')}",
+        )
+    counts = {s.lower(): sum(str(f.get("severity", "")).upper() == s for f in findings)
+              for s in reversed(severities)}
+    log.info("tfsec findings", **counts)
+    return failing
+
+
+async def main(args: argparse.Namespace):
+    # bounds the number of tfsec processes running at once
+    limiter = anyio.CapacityLimiter(max(1, args.jobs))
+    failures: list[str] = []
+    findings: dict[tuple, dict] = {}
+    roots = 0
+
+    # the cache is only used when given, so that nothing is written to the working tree
+    # by default
+    use_cache = bool(args.cache_file) and not args.no_cache
+    cache: dict = {}
+    version = ""
+    if use_cache:
+        count_subprocess()
+        process = await anyio.run_process(["tfsec", "--version"], check=False)
+        version = process.stdout.decode().strip()
+        cache = load_cache(args.cache_file)
+        if cache.get("version") != version:
+            cache = {}
+    cached_roots: dict[str, list] = cache.get("roots", {})
+    cached_sources: dict[str, list] = cache.get("sources", {})
+    # only the entries used by this run are kept
+    roots_used: dict[str, list] = {}
+    sources_used: dict[str, list] = {}
+    replayed = 0
+
+    async def run(path: str):
+        nonlocal replayed
+        digest = None
+        if use_cache:
+            digest = root_digest(path, version, cached_sources, sources_used)
+            if digest in cached_roots:
+                replayed += 1
+                results = roots_used[digest] = cached_roots[digest]
+                for finding in relocate(results, os.curdir, args.dir):
+                    findings.setdefault(finding_key(finding), finding)
+                return
+        async with limiter:
+            # failures are collected rather than raised, so that they don't cancel
+            # the other scans
+            try:
+                results = await tfsec(path)
+            except TfsecError as exc:
+                log.error(str(exc), path=path)
+                failures.append(path)
+                return
+        results = relocate(results, args.dir, args.dir)
+        if digest is not None:
+            roots_used[digest] = relocate(results, args.dir, os.curdir)
+        for finding in results:
+            findings.setdefault(finding_key(finding), finding)
+
+    async with anyio.create_task_group() as tg:
+        for path in filesystem.walk_files(args.dir, "main.tf"):
+            roots += 1
+            tg.start_soon(run, os.path.dirname(path))
+            # let the scan start while the rest of the tree is walked
+            await anyio.lowlevel.checkpoint()
+
+    if use_cache:
+        write_json(
+            args.cache_file, {"version": version, "roots": roots_used, "sources": sources_used}
+        )
+        log.info(
+            "tfsec cache", replayed=replayed, scanned=roots - replayed, cache=args.cache_file
+        )
+
+    merged = [findings[key] for key in sorted(findings, key=lambda k: tuple(map(str, k)))]
+    if args.json:
+        write_json(args.json, {"results": merged})
+    if args.sarif:
+        write_json(args.sarif, sarif(merged))
+
+    failing = summary(merged, args.severity)
+    if failures:
+        log.error("tfsec failed", roots=sorted(failures))
+    if failing or failures:
+        print("💥 💔 💥 tfsec code check failed.")
+        raise SystemExit(1)
+    print(f"✨ 🍰 ✨ tfsec code check passed ({roots} roots)")
+
+
+def cli(argv: Optional[list[str]] = None):
+    """Entry point of the `dul-tfsec` command."""
+    parser = argparse.ArgumentParser(prog="dul-tfsec")
+    parser.add_argument("dir", nargs='?', default=os.getcwd())
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="Maximum number of concurrent tfsec processes. CPU count if not set"
+    )
+    parser.add_argument(
+        "-s", "--severity", type=str.upper, choices=severities, default="LOW",
+        help="Minimum severity of the findings failing the check. LOW if not set"
+    )
+    parser.add_argument("--json", default=None, help="Write the merged findings to this JSON file")
+    parser.add_argument(
+        "--sarif", default=None, help="Write the merged findings to this SARIF file"
+    )
+    parser.add_argument(
+        "--cache-file", default=None,
+        help="Findings cache file. No cache is used if not set"
+    )
+    parser.add_argument(
+        "--no-cache", action='store_true',
+        help="Scan every root, ignoring the findings cache"
+    )
+    args = parser.parse_args(argv)
+
+    configure()
+    anyio.run(main, args)
+
+
+if __name__ == "__main__":
+    cli()
@@ -17,13 +17,19 @@ setup(
     description="Dagger Utilities Library",
     author="Daniil Trishkin",
     license="MIT",
-    packages=find_namespace_packages(),
+    packages=find_namespace_packages(include=["dul", "dul.*"]),
     install_requires=requirements,
     extras_require={
         "pipelines": pipeline_requirements,
         "scripts": scripts_requirements,
+        # inotify backend of `dul-atlantis-populate --watch`, which polls otherwise
+        "watch": ["inotify_simple"],
     },
-    package_data={
-        "": ["scripts/**/*.sh"],
+    entry_points={
+        "console_scripts": [
+            "dul-atlantis-populate = dul.scripts.atlantis.populate_config:cli",
+            "dul-terraform-docs = dul.scripts.terraform.docs:cli",
+            "dul-tfsec = dul.scripts.terraform.tfsec:cli",
+        ],
     },
 )
@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.monorepo import generate
+
+
+@pytest.fixture
+def monorepo(tmp_path, monkeypatch) -> str:
+    """A small synthetic Terraform monorepo, also the working directory of the test."""
+    root = generate(str(tmp_path / "repo"), projects=6, modules=12, depth=3)
+    monkeypatch.chdir(root)
+    return root
@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks import run
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory) -> dict:
+    """The benchmark results on a small synthetic monorepo, keyed by case."""
+    work_dir = tmp_path_factory.mktemp("bench")
+    return {r["case"]: r for r in run.run(["3x6"], depth=2, repeat=1, work_dir=str(work_dir))}
+
+
+def test_every_case_succeeds(results):
+    assert {case: r["returncode"] for case, r in results.items() if r["returncode"]} == {}
+
+
+@pytest.mark.parametrize("tool", ["terraform-docs check", "tfsec"])
+def test_cached_runs_spare_the_tool(results, tool):
+    # only the version of the tool is queried when nothing changed
+    assert results[f"{tool} cold"]["subprocesses"] > results[f"{tool} cached"]["subprocesses"]
+    assert results[f"{tool} cached"]["subprocesses"] == 1
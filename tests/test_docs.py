@@ -0,0 +1,95 @@
+import os
+import sys
+
+import anyio
+import pytest
+
+from dul.scripts.terraform import docs
+
+content = "| Name |\n|------|\n| main.tf |\n"
+generated = f"{docs.begin_marker}\n{content.rstrip()}\n{docs.end_marker}"
+custom_template = "<!-- BEGIN_DOCS -->\n{{ .Content }}\n<!-- END_DOCS -->"
+
+# stand-in for terraform-docs: the content is written to the output file of the command
+# line, else of the configuration, else printed
+terraform_docs_stub = f"""#!{sys.executable}
+import os, sys
+args = sys.argv[1:]
+path = args[-1]
+output_file = None
+config = os.path.join(path, ".terraform-docs.yml")
+if os.path.exists(config):
+    for line in open(config):
+        if line.strip().startswith("file:"):
+            output_file = line.split(":", 1)[1].strip()
+if "--output-file" in args:
+    output_file = args[args.index("--output-file") + 1]
+if output_file:
+    open(os.path.join(path, output_file), "a").write("written")
+else:
+    print({content!r})
+"""
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch) -> str:
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    (bin / "terraform-docs").write_text(terraform_docs_stub)
+    (bin / "terraform-docs").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin}{os.pathsep}{os.environ['PATH']}")
+    path = tmp_path / "module"
+    path.mkdir()
+    (path / "main.tf").write_text('variable "name" {}\n')
+    return str(path)
+
+
+def test_inject_in_empty_readme():
+    assert docs.inject("", content) == generated
+
+
+def test_inject_without_markers():
+    assert docs.inject("# Title\n", content) == "# Title\n\n" + generated
+
+
+def test_inject_between_markers():
+    readme = f"# Title\n{docs.begin_marker}\nold\n{docs.end_marker}\nfooter\n"
+    assert docs.inject(readme, content) == f"# Title\n{generated}\nfooter\n"
+
+
+def test_inject_with_custom_template():
+    readme = "# Title\n<!-- BEGIN_DOCS -->\nold\n<!-- END_DOCS -->\n"
+    assert docs.inject(readme, content, custom_template) == (
+        f"# Title\n<!-- BEGIN_DOCS -->\n{content.rstrip()}\n<!-- END_DOCS -->\n"
+    )
+
+
+@pytest.mark.parametrize("template", ["{{ .Content }}", "<!-- BEGIN -->\n<!-- END -->"])
+def test_inject_with_invalid_template(template):
+    with pytest.raises(docs.DocsError):
+        docs.inject("", content, template)
+
+
+def test_output_template_from_configuration(module):
+    assert docs.output_template(module) == docs.default_template
+    config = "output:\n  template: |-\n" + "".join(
+        f"    {line}\n" for line in custom_template.split("\n")
+    )
+    with open(os.path.join(module, ".terraform-docs.yml"), "w") as fp:
+        fp.write(config)
+    assert docs.output_template(module) == custom_template
+
+
+def test_check_never_writes(module):
+    with open(os.path.join(module, ".terraform-docs.yml"), "w") as fp:
+        fp.write("output:\n  file: README.md\n  mode: inject\n")
+    readme = os.path.join(module, "README.md")
+    with open(readme, "w") as fp:
+        fp.write(f"{docs.begin_marker}\n{docs.end_marker}\n")
+    assert anyio.run(docs.check, module) is not None
+    with open(readme) as fp:
+        assert fp.read() == f"{docs.begin_marker}\n{docs.end_marker}\n"
+
+    with open(readme, "w") as fp:
+        fp.write(generated)
+    assert anyio.run(docs.check, module) is None
@@ -0,0 +1,103 @@
+import os
+import posixpath
+import subprocess
+
+import pytest
+
+from dul.scripts.common.git import GitIndex, git_find_files, match_pathspec
+
+files = [
+    "top.tf",
+    "a/main.tf",
+    "a/[x].tf",
+    "a/x.tf",
+    "a/star*.tf",
+    "a/q?.tf",
+    "a/config.yaml",
+    "a/b/c.yaml",
+    "a/b/f.tf",
+    "a/b/d/e.yaml",
+    "a/b/d/e.yml",
+    "ab/other.tf",
+    "docs/README.md",
+]
+
+# (cwd, pathspec)
+specs = [
+    (".", "a/*.tf"),
+    (".", "a/**/*.yaml"),
+    (".", "*.tf"),
+    (".", "a"),
+    (".", "a/"),
+    (".", "a/b"),
+    (".", "a/b/"),
+    (".", "."),
+    (".", "./a/*.yaml"),
+    (".", "a/[x].tf"),
+    (".", "a/star*.tf"),
+    (".", "a/q?.tf"),
+    (".", "a/[mx]*.tf"),
+    (".", "a/b/*"),
+    (".", "missing"),
+    ("a", "*.tf"),
+    ("a", "b/"),
+    ("a", "b/**/*.yaml"),
+    ("a", "./b/*.tf"),
+    ("a", "../top.tf"),
+    ("a", "../ab"),
+    ("a", "[x].tf"),
+    ("a/b", "../*.yaml"),
+    ("a/b", "../../docs/"),
+    ("a/b", "."),
+]
+
+
+@pytest.fixture(scope="module")
+def repo(tmp_path_factory) -> str:
+    root = str(tmp_path_factory.mktemp("git"))
+    for file in files:
+        os.makedirs(os.path.join(root, os.path.dirname(file)), exist_ok=True)
+        with open(os.path.join(root, file), "w") as fp:
+            fp.write(file)
+    subprocess.run(["git", "init", "-q", root], check=True)
+    subprocess.run(["git", "-C", root, "add", "-A"], check=True)
+    return root
+
+
+def _git_ls_files(cwd: str, pathspec: str) -> list[str]:
+    sub = subprocess.run(
+        ["git", "ls-files", "-z", "--", pathspec], cwd=cwd, capture_output=True, check=True
+    )
+    return [p for p in sub.stdout.decode().split("\0") if p]
+
+
+@pytest.mark.parametrize("cwd,pathspec", specs)
+def test_ls_files_matches_git(repo, cwd, pathspec):
+    index = GitIndex.load(repo)
+    expected = _git_ls_files(os.path.join(repo, cwd), pathspec)
+    assert index.ls_files([pathspec], cwd=os.path.join(repo, cwd)) == expected
+
+
+@pytest.mark.parametrize("cwd,pathspec", [(cwd, spec) for cwd, spec in specs if cwd == "."])
+def test_match_pathspec_matches_git(repo, cwd, pathspec):
+    # match_pathspec takes pathspecs normalized relative to the repo root
+    normalized = posixpath.normpath(pathspec)
+    if normalized == ".":
+        normalized = ""
+    elif pathspec.endswith("/"):
+        normalized += "/"
+    expected = _git_ls_files(repo, pathspec)
+    assert [file for file in sorted(files) if match_pathspec(normalized, file)] == sorted(expected)
+
+
+def test_outside_of_the_repo_is_refused(repo):
+    with pytest.raises(SystemExit):
+        GitIndex.load(repo).ls_files(["../outside"], cwd=repo)
+
+
+def test_find_files_without_index(repo, monkeypatch):
+    monkeypatch.chdir(repo)
+    assert sorted(git_find_files("a", ["-name", "*.yaml"])) == [
+        "a/b/c.yaml", "a/b/d/e.yaml", "a/config.yaml"
+    ]
+    assert git_find_files("a", ["-name", "*.yaml"], GitIndex.load(repo)) != []
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from benchmarks.importtime import importtime
+
+# command module: cumulative import time budget in milliseconds
+budgets = {
+    "dul.scripts.atlantis.populate_config": 100,
+    "dul.scripts.terraform.docs": 250,
+    "dul.scripts.terraform.tfsec": 250,
+}
+# factor applied to the budgets, on slow machines
+scale = float(os.environ.get("DUL_IMPORTTIME_SCALE", "1"))
+# top-level packages only imported when they are used
+lazy = {"hcl2", "lark", "ruamel", "dagger"}
+# populate_config only logs when tracing is enabled
+lazy_per_module = {"dul.scripts.atlantis.populate_config": {"structlog", "rich", "asyncio"}}
+
+
+@pytest.mark.parametrize("module", budgets)
+def test_heavy_dependencies_are_imported_lazily(module):
+    _, packages = importtime(module)
+    assert packages & (lazy | lazy_per_module.get(module, set())) == set()
+
+
+@pytest.mark.parametrize("module", budgets)
+def test_import_time_is_within_budget(module):
+    # the fastest of a few runs, to smooth out the noise
+    best = min(importtime(module)[0] for _ in range(3))
+    assert best <= budgets[module] * scale
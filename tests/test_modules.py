@@ -0,0 +1,179 @@
+import io
+import os
+import subprocess
+
+import hcl2
+import pytest
+
+from benchmarks.monorepo import generate
+from dul.scripts.atlantis import populate_config
+from dul.scripts.common import filesystem
+from dul.scripts.common.git import GitIndex
+from dul.scripts.common.modules import (
+    ModuleGraph, module_sources, scan_module_sources, source_type
+)
+
+# files exercising the scanner: comments, heredocs, templates, nested blocks and
+# sources hcl2 has to evaluate
+tricky = {
+    "comments.tf": (
+        '/* module "z" {\n  source = "./no"\n} */\n'
+        '# module "q" {\n'
+        'module "e" { # {\n  // }\n  source = "./e"\n}\n'
+    ),
+    "heredoc.tf": (
+        'module "d" {\n  source = "./d"\n'
+        '  policy = <<EOF\nmodule "fake" {\n  source = "./no"\n}\nEOF\n}\n'
+        'resource "aws_iam_policy" "p" {\n  policy = <<-EOT\n    }}}\n    EOT\n}\n'
+    ),
+    "nested.tf": (
+        'module "f" {\n  providers = {\n    aws = aws.x\n  }\n  source = "./f"\n'
+        '  tags = merge({ a = "}" }, { b = "${var.x}" })\n}\n'
+    ),
+    "templates.tf": (
+        'locals {\n  x = "${var.a}-{}"\n  y = "%{if var.a}}%{endif}"\n}\n'
+        'module "i" {\n  source = "./i"\n}\n'
+    ),
+    "no_source.tf": 'module "c" {\n  version = "1.0.0"\n}\n',
+    "one_line.tf": 'module "h" { source = "./h" }\nmodule "h2" { source = "../h2" }\n',
+    "registry.tf": (
+        'module "vpc" {\n  source  = "terraform-aws-modules/vpc/aws"\n  version = "~> 3.0"\n\n'
+        '  azs = ["a", "b"]\n  cidr = "10.0.0.0/16"\n}\n'
+    ),
+}
+# files whose sources aren't literal, left to hcl2
+computed = {
+    "interpolated.tf": 'module "b" {\n  source = "git::https://x/y.git?ref=${var.ref}"\n}\n',
+    "conditional.tf": 'module "g" {\n  source = var.a ? "./a" : "./b"\n}\n',
+    "concat.tf": 'module "k" {\n  source = "./k" # ./no\n  count = 1\n}\nmodule "l" {\n'
+                 '  source = "./${local.l}"\n}\n',
+}
+
+
+def _hcl2_pairs(text: str) -> list:
+    return [
+        (name, block.get("source"))
+        for module in hcl2.loads(text).get("module", [])
+        for name, block in module.items()
+    ]
+
+
+@pytest.mark.parametrize("name", sorted(tricky))
+def test_scanner_matches_hcl2(name):
+    assert scan_module_sources(tricky[name]) == _hcl2_pairs(tricky[name])
+
+
+@pytest.mark.parametrize("name", sorted(computed))
+def test_computed_sources_are_left_to_hcl2(name, tmp_path):
+    assert scan_module_sources(computed[name]) is None
+    file = tmp_path / name
+    file.write_text(computed[name])
+    assert module_sources(str(file)) == [source for _, source in _hcl2_pairs(computed[name])]
+
+
+def test_scanner_matches_hcl2_on_corpus(tmp_path):
+    # a generated monorepo with large files, and the directories listed in
+    # DUL_TF_CORPUS, e.g. checkouts of real-world infrastructure repos
+    dirs = [generate(str(tmp_path / "repo"), projects=6, modules=12, resources=50)]
+    dirs += [dir for dir in os.environ.get("DUL_TF_CORPUS", "").split(os.pathsep) if dir]
+    mismatches = {}
+    compared = 0
+    for dir in dirs:
+        for file in filesystem.walk_files(dir, "*.tf"):
+            with open(file) as fp:
+                text = fp.read()
+            pairs = scan_module_sources(text)
+            if pairs is None:
+                continue
+            try:
+                expected = _hcl2_pairs(text)
+            except Exception:
+                # files hcl2 can't parse aren't comparable
+                continue
+            compared += 1
+            if pairs != expected:
+                mismatches[file] = (pairs, expected)
+    assert compared > 0
+    assert mismatches == {}
+
+
+@pytest.mark.parametrize("source,expected", [
+    ("./modules/x", "local"),
+    ("../x", "local"),
+    ("terraform-aws-modules/vpc/aws", "registry"),
+    ("app.terraform.io/org/vpc/aws", "registry"),
+    ("git::https://example.com/vpc.git?ref=v1", "git"),
+    ("git@github.com:org/vpc.git", "git"),
+    ("github.com/org/vpc", "git"),
+    ("https://example.com/vpc.zip", "http"),
+    ("s3::https://s3.amazonaws.com/bucket/vpc.zip", "s3"),
+    ("./${var.x}", "unknown"),
+    (None, "unknown"),
+])
+def test_source_type(source, expected):
+    assert source_type(source) == expected
+
+
+def _module(*sources: str) -> str:
+    return "".join(
+        f'module "m{i}" {{\n  source = "{source}"\n}}\n' for i, source in enumerate(sources)
+    )
+
+
+@pytest.fixture
+def graph(tmp_path) -> ModuleGraph:
+    files = {
+        # diamond: project -> x, y -> z
+        "project/main.tf": _module("../modules/x", "../modules/y"),
+        "modules/x/main.tf": _module("../z"),
+        "modules/y/main.tf": _module("../z"),
+        "modules/z/main.tf": 'variable "name" {}\n',
+        # cycle: a -> b -> a
+        "cycle/main.tf": _module("../modules/a"),
+        "modules/a/main.tf": _module("../b"),
+        "modules/b/main.tf": _module("../a"),
+        # remote sources, and a nested module relative to the calling module's file
+        "remote/main.tf": _module(
+            "terraform-aws-modules/vpc/aws",
+            "git::https://example.com/vpc.git?ref=v1",
+            "https://example.com/vpc.zip",
+            "../modules/outer",
+        ),
+        "modules/outer/main.tf": _module("./inner"),
+        "modules/outer/inner/main.tf": 'variable "name" {}\n',
+        # decoys at the paths the nested source would have if resolved from the project
+        "remote/inner/main.tf": 'variable "name" {}\n',
+        "modules/inner/main.tf": 'variable "name" {}\n',
+    }
+    root = tmp_path / "repo"
+    for file, text in files.items():
+        (root / file).parent.mkdir(parents=True, exist_ok=True)
+        (root / file).write_text(text)
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    subprocess.run(["git", "-C", str(root), "add", "-A"], check=True)
+    return ModuleGraph(GitIndex.load(str(root)))
+
+
+def test_closure_visits_diamonds_once(graph):
+    closure = graph.closure("project")
+    assert closure.dirs == ["project", "modules/x", "modules/z", "modules/y"]
+    assert closure.cycles == []
+
+
+def test_closure_terminates_on_cycles(graph, monkeypatch):
+    closure = graph.closure("cycle")
+    assert closure.dirs == ["cycle", "modules/a", "modules/b"]
+    assert closure.cycles == [["modules/a", "modules/b", "modules/a"]]
+
+    err = io.StringIO()
+    monkeypatch.setattr(populate_config, "stderr", err)
+    when_modified = populate_config._resolve_atlantis_project_path(graph, "cycle")
+    assert "../modules/b/*.tf" in when_modified
+    assert "Warning: module cycle in project cycle: modules/a -> modules/b -> modules/a" in (
+        err.getvalue()
+    )
+
+
+def test_closure_skips_remote_sources(graph):
+    # nested sources are relative to the calling module, not to the project
+    assert graph.closure("remote").dirs == ["remote", "modules/outer", "modules/outer/inner"]
@@ -0,0 +1,52 @@
+from dagger.api.base import Context, Type
+from dagger.api.gen import Client
+
+from dul.pipelines import atlantis, generic, terraform
+
+
+def _query(obj) -> list:
+    """Helper function to get the selections of a query, with the objects passed as
+    arguments replaced by their own selections."""
+    return [
+        (field.type_name, field.name, {
+            key: _query(value) if isinstance(value, Type) else value
+            for key, value in field.args.items()
+        })
+        for field in obj._ctx.selections
+    ]
+
+
+def _pipeline(random_mount: bool = False) -> list:
+    # queries are built without an engine, a new client standing for a new run
+    client = Client(Context(session=None, schema=None))
+    src = client.host().directory("src")
+    container, root = generic.init(client, "alpine", src, random_mount=random_mount)
+    container = terraform.toolchain(
+        client, container, terraform="1.3.0", tfsec="1.28.1", docs="0.16.0"
+    )
+    return [
+        _query(terraform.docs(client, container, root, random_mount=random_mount)),
+        _query(terraform.tfsec(client, container, root, random_mount=random_mount)),
+        _query(atlantis.populate_config(client, container, root, random_mount=random_mount)),
+    ]
+
+
+def test_queries_are_identical_across_runs():
+    assert _pipeline() == _pipeline()
+
+
+def test_random_mount_is_opt_in():
+    assert _pipeline(random_mount=True) != _pipeline(random_mount=True)
+
+
+def test_toolchain_fetches_do_not_depend_on_base():
+    client = Client(Context(session=None, schema=None))
+    base = client.container().from_("alpine")
+
+    def fetched(container) -> list:
+        query = _query(terraform.toolchain(client, container, terraform="1.3.0", tfsec="1.28.1"))
+        return [args["source"] for _, name, args in query if name == "withFile"]
+
+    files = fetched(base)
+    assert len(files) == 2
+    assert fetched(base.with_exec(["apk", "add", "git"])) == files
@@ -0,0 +1,149 @@
+import io
+import os
+import subprocess
+from typing import Dict, List, Set, Tuple
+
+import pytest
+
+from dul.scripts.atlantis import populate_config
+
+
+def _populate(repo: str, **kwargs) -> bytes:
+    atlantis_yaml = os.path.join(repo, "atlantis.yaml")
+    with open(atlantis_yaml, "rb") as fp:
+        original = fp.read()
+    assert populate_config.main(atlantis_yaml, False, **kwargs) == 0
+    with open(atlantis_yaml, "rb") as fp:
+        res = fp.read()
+    with open(atlantis_yaml, "wb") as fp:
+        fp.write(original)
+    return res
+
+
+def test_jobs_output_is_identical_to_serial(monorepo):
+    serial = _populate(monorepo, jobs=1)
+    # the shared modules are part of the projects' dependencies
+    assert b"modules/l2/" in serial
+    assert _populate(monorepo, jobs=4) == serial
+
+
+def test_check_after_update(monorepo):
+    atlantis_yaml = os.path.join(monorepo, "atlantis.yaml")
+    assert populate_config.main(atlantis_yaml, True) == 1
+    assert populate_config.main(atlantis_yaml, False) == 0
+    assert populate_config.main(atlantis_yaml, True) == 0
+
+
+def _projects(text: bytes) -> Dict[str, bytes]:
+    # the YAML of each project, keyed by directory
+    blocks = text.split(b"\n  - dir: ")[1:]
+    return {block.split(b"\n", 1)[0].decode(): block for block in blocks}
+
+
+def _git(repo: str, *args: str) -> None:
+    git = ["git", "-C", repo, "-c", "user.name=test", "-c", "user.email=test@localhost"]
+    subprocess.run(git + list(args), check=True, capture_output=True)
+
+
+@pytest.fixture
+def updated(monorepo) -> str:
+    """The monorepo with an up-to-date and committed atlantis configuration."""
+    assert populate_config.main(os.path.join(monorepo, "atlantis.yaml"), False) == 0
+    _git(monorepo, "commit", "-q", "-am", "Update atlantis configuration")
+    return monorepo
+
+
+def _source_new_module(repo: str) -> Tuple[Set[str], List[str]]:
+    """Helper function to make a first-level module, used by some of the projects only,
+    source a new module.
+
+    Returns:
+        The directories of the projects using the first-level module, and the changed files.
+    """
+    with open(os.path.join(repo, "atlantis.yaml"), "rb") as fp:
+        projects = _projects(fp.read())
+    modules = sorted(os.listdir(os.path.join(repo, "modules", "l0")))
+    users = {
+        module: {dir for dir, block in projects.items() if f"l0/{module}/".encode() in block}
+        for module in modules
+    }
+    module = next(module for module in modules if 0 < len(users[module]) < len(projects))
+    os.makedirs(os.path.join(repo, "modules", "extra"))
+    with open(os.path.join(repo, "modules", "extra", "main.tf"), "w") as fp:
+        fp.write('variable "name" {}\n')
+    with open(os.path.join(repo, "modules", "l0", module, "main.tf"), "a") as fp:
+        fp.write('module "extra" {\n  source = "../../extra"\n}\n')
+    _git(repo, "add", "-A")
+    return users[module], ["modules/extra/main.tf", f"modules/l0/{module}/main.tf"]
+
+
+def _check_partial_update(repo: str, argv: List[str], monkeypatch) -> None:
+    atlantis_yaml = os.path.join(repo, "atlantis.yaml")
+    with open(atlantis_yaml, "rb") as fp:
+        before = fp.read()
+    users, changes = _source_new_module(repo)
+    full = _populate(repo)
+
+    monkeypatch.setattr(populate_config, "stdin", io.StringIO("".join(f"{f}\n" for f in changes)))
+    assert populate_config.cli(argv) == 0
+    with open(atlantis_yaml, "rb") as fp:
+        after = fp.read()
+    assert after == full
+    old, new = _projects(before), _projects(after)
+    for dir in old:
+        if dir in users:
+            assert b'"../../../modules/extra/*.tf"' in new[dir]
+        else:
+            # the unaffected projects are left byte-identical
+            assert new[dir] == old[dir]
+
+
+def test_stdin(updated, monkeypatch):
+    _check_partial_update(updated, ["--stdin"], monkeypatch)
+
+
+def test_since(updated, monkeypatch):
+    _check_partial_update(updated, ["--since", "HEAD"], monkeypatch)
+
+
+def test_affected_projects():
+    projects = [
+        {"dir": "a", "autoplan": {"when_modified": [
+            "./*.tf", "./**/*.yaml", "../modules/x/*.tf", "../modules/x/**/*.yaml",
+        ]}},
+        {"dir": "b", "autoplan": {"when_modified": ["./*.tf"]}},
+        {"dir": "c"},
+        {"dir": "d", "autoplan": {"when_modified": []}},
+    ]
+
+    def affected(*files: str) -> Set[int]:
+        return populate_config._affected_projects(projects, list(files))
+
+    # projects without "when_modified" are always affected
+    assert affected() == {2, 3}
+    assert affected("a/main.tf") == {0, 2, 3}
+    assert affected("modules/y/main.tf", "b/README.md", "README.md") == {2, 3}
+    # files deep in a module are matched against the globs of their ancestors
+    assert affected("modules/x/config/deep/values.yaml") == {0, 2, 3}
+    assert affected("modules/x/deep/README.md") == {2, 3}
+    # a new file of a tracked type may add a glob to the module
+    assert affected("b/templates/policy.tpl") == {1, 2, 3}
+    assert affected("b/config/values.yml") == {1, 2, 3}
+    assert affected("./b/main.tf", "modules/x/main.tf") == {0, 1, 2, 3}
+
+
+def test_affected_projects_at_the_root():
+    projects = [
+        {"dir": ".", "autoplan": {"when_modified": ["./*.tf"]}},
+        {"dir": "a", "autoplan": {"when_modified": ["./*.tf"]}},
+    ]
+
+    def affected(*files: str) -> Set[int]:
+        return populate_config._affected_projects(projects, list(files))
+
+    assert affected("main.tf") == {0}
+    assert affected("README.md", "a/README.md") == set()
+    # like in git, `*` matches across directories: the "./*.tf" glob covers every
+    # terraform file, and any file of a tracked type may add a glob to the root
+    assert affected("a/main.tf") == {0, 1}
+    assert affected("a/config/values.yaml") == {0, 1}
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from dul.pipelines.runner import Job, Runner
+
+
+def _job(name: str, needs=(), sleep: float = 0.0, fail: bool = False, events=None) -> Job:
+    # stand-in for a dagger job, recording when it starts and ends
+    async def func(client):
+        if events is not None:
+            events.append(("start", name, time.monotonic()))
+        await asyncio.sleep(sleep)
+        if events is not None:
+            events.append(("end", name, time.monotonic()))
+        if fail:
+            raise RuntimeError(f"{name} failed")
+
+    return Job(name, func, list(needs))
+
+
+def _statuses(runner: Runner) -> dict:
+    return {name: result.status for name, result in runner.results.items()}
+
+
+def _failing_jobs() -> list:
+    return [
+        _job("a"),
+        _job("b", needs=["a"], sleep=0.05, fail=True),
+        _job("c", sleep=0.5),
+        _job("d", needs=["b"]),
+        _job("e", needs=["d"]),
+        _job("f", needs=["a", "c"]),
+    ]
+
+
+def test_fail_fast():
+    runner = Runner(None, _failing_jobs(), limit=4, fail_fast=True)
+    assert asyncio.run(runner.run()) is False
+    # the dependents of the failed job are skipped, the other jobs cancelled
+    assert _statuses(runner) == {
+        "a": "success", "b": "failed", "c": "cancelled", "d": "skipped", "e": "skipped",
+        "f": "skipped",
+    }
+    assert isinstance(runner.results["b"].error, RuntimeError)
+
+
+def test_collect_all():
+    runner = Runner(None, _failing_jobs(), limit=4, fail_fast=False)
+    assert asyncio.run(runner.run()) is False
+    assert _statuses(runner) == {
+        "a": "success", "b": "failed", "c": "success", "d": "skipped", "e": "skipped",
+        "f": "success",
+    }
+
+
+def test_needs_ordering():
+    events = []
+    jobs = [
+        _job("deploy", needs=["build", "test"], events=events),
+        _job("test", needs=["build"], sleep=0.02, events=events),
+        _job("build", sleep=0.02, events=events),
+        _job("lint", sleep=0.01, events=events),
+    ]
+    runner = Runner(None, jobs)
+    assert asyncio.run(runner.run()) is True
+    times = {(kind, name): at for kind, name, at in events}
+    assert times[("end", "build")] <= times[("start", "test")]
+    assert times[("end", "test")] <= times[("start", "deploy")]
+    # jobs without needs start right away
+    assert times[("start", "lint")] < times[("end", "build")]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_concurrency_limit(limit):
+    running = 0
+    peak = 0
+
+    async def func(client):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    runner = Runner(None, [Job(f"job{i}", func) for i in range(8)], limit=limit)
+    assert asyncio.run(runner.run()) is True
+    assert peak == limit
+
+
+def test_invalid_jobs():
+    with pytest.raises(ValueError, match="unique"):
+        Runner(None, [_job("a"), _job("a")])
+    with pytest.raises(ValueError, match="unknown"):
+        Runner(None, [_job("a", needs=["b"])])
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        Runner(None, [_job("a", needs=["b"]), _job("b", needs=["a"])])